@@ -0,0 +1,8 @@
+'''
+Benchmarks for the recommender service, running against synthetic data with a
+local stand-in for Solr and an SQLite stand-in for the Postgres database.
+
+    python -m benchmarks.run --data /tmp/recommender-bench --generate
+
+see benchmarks/run.py for the options, and benchmarks/knn.py for the nearest neighbour search
+'''
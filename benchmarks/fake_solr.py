@@ -0,0 +1,95 @@
+'''
+Local stand-in for the ADS Solr service, answering the queries the recommender
+makes (keywords of a paper and its references, bulk bibcode lookups) from an
+in-memory corpus, with a configurable latency per query
+'''
+import re
+import time
+import random
+import threading
+import urlparse
+import simplejson as json
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+KEYWORDS_QUERY = re.compile(r'^bibcode:(\S+) or references\(bibcode:(\S+)\)$')
+TERMS_QUERY = re.compile(r'^\{!terms f=bibcode\}(.*)$')
+BIBCODE_QUERY = re.compile(r'bibcode:([^\s()]+)')
+
+class FakeSolr(ThreadingMixIn, HTTPServer):
+    '''
+    Threaded HTTP server answering Solr select queries for the documents in 'docs'.
+    Every query takes 'latency' seconds, plus a uniformly distributed 'jitter'.
+    '''
+    daemon_threads = True
+
+    def __init__(self, docs, latency=0.0, jitter=0.0, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), SolrHandler)
+        self.docs = dict((doc['bibcode'], doc) for doc in docs)
+        self.latency = latency
+        self.jitter = jitter
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s/solr/collection1/select' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def search(self, q):
+        '''
+        Return the documents matching a query
+        '''
+        match = KEYWORDS_QUERY.match(q)
+        if match:
+            doc = self.docs.get(match.group(1))
+            if doc is None:
+                return []
+            return [doc] + [self.docs[ref] for ref in doc.get('reference', []) if ref in self.docs]
+        match = TERMS_QUERY.match(q)
+        if match:
+            bibcodes = match.group(1).split(',')
+        else:
+            bibcodes = BIBCODE_QUERY.findall(q)
+        return [self.docs[bibcode] for bibcode in bibcodes if bibcode in self.docs]
+
+    def select(self, params):
+        with self.lock:
+            self.queries += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        docs = self.search(params.get('q', ''))
+        if params.get('sort', '').startswith('pubdate desc'):
+            docs = sorted(docs, key=lambda a: (a.get('pubdate', ''), a['bibcode']), reverse=True)
+        docs = docs[:int(params.get('rows', 10))]
+        if params.get('fl'):
+            fields = params['fl'].split(',')
+            docs = [dict((k, v) for k, v in doc.items() if k in fields) for doc in docs]
+        return {'responseHeader': {'status': 0, 'params': params},
+                'response': {'numFound': len(docs), 'start': 0, 'docs': docs}}
+
+class SolrHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond(urlparse.urlparse(self.path).query)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        self.respond(self.rfile.read(length))
+
+    def respond(self, query):
+        params = dict((k, v[0]) for k, v in urlparse.parse_qs(query).items())
+        body = json.dumps(self.server.select(params))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,77 @@
+'''
+Nearest neighbour search in a cluster: brute force against the KD-tree, for a
+range of cluster sizes, on synthetic 5-dimensional coordinates. Reports the time
+per query of CoordinateSnapshot.nearest() and nearest_many(), and checks that both
+methods find the same neighbours.
+
+    python -m benchmarks.knn --sizes 1000 10000 100000 1000000
+
+Use the crossover size as CLUSTER_TREE_MIN_SIZE.
+'''
+import sys
+import time
+import argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from recommender.utils.coordinates import CoordinateSnapshot
+from recommender.utils.trees import LEAF_SIZE
+
+def make_snapshot(coordinates, tree=None):
+    '''
+    An in-memory snapshot with a single cluster (0), searched with 'tree' if given
+    '''
+    snapshot = CoordinateSnapshot(None)
+    snapshot.state = {
+        'bibcodes': np.array(['%019d' % i for i in range(len(coordinates))]),
+        'coordinates': coordinates,
+        'clusters': np.array([0], dtype=np.int32),
+        'offsets': np.array([0, len(coordinates)], dtype=np.int64),
+        'trees': {0: tree} if tree is not None else {},
+    }
+    return snapshot
+
+def best_of(func, repeat):
+    timings = []
+    for i in range(repeat):
+        started = time.time()
+        result = func()
+        timings.append(time.time() - started)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare brute force and KD-tree nearest neighbour search')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 5000, 10000, 100000, 1000000],
+                        help='Cluster sizes')
+    parser.add_argument('--queries', type=int, default=200, help='Number of query vectors')
+    parser.add_argument('--k', type=int, default=40, help='Number of neighbours (MAX_NEIGHBORS)')
+    parser.add_argument('--dimensions', type=int, default=5, help='Dimensionality of the coordinates')
+    parser.add_argument('--repeat', type=int, default=3, help='Report the best of this many runs')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(42)
+    out = sys.stdout
+    out.write('%10s %10s %12s %12s %12s %12s %8s\n' %
+              ('size', 'build (s)', 'brute (us)', 'tree (us)', 'brute many', 'tree many', 'same'))
+    for size in args.sizes:
+        # Members scattered around a few sub-topics, like the coordinates of real clusters
+        centres = rng.randn(10, args.dimensions)
+        coordinates = (centres[rng.randint(10, size=size)] + 0.3*rng.randn(size, args.dimensions)).astype(np.float32)
+        queries = coordinates[rng.randint(size, size=args.queries)] + 0.1*rng.randn(args.queries, args.dimensions)
+        started = time.time()
+        tree = cKDTree(coordinates, leafsize=LEAF_SIZE)
+        build = time.time() - started
+        brute, tree_snapshot = make_snapshot(coordinates), make_snapshot(coordinates, tree)
+
+        results = {}
+        for name, snapshot in (('brute', brute), ('tree', tree_snapshot)):
+            single, found = best_of(lambda: [snapshot.nearest(0, vec, args.k) for vec in queries], args.repeat)
+            many, found_many = best_of(lambda: snapshot.nearest_many(0, queries, args.k), args.repeat)
+            results[name] = (single, many, found, found_many)
+        same = all(set(a) == set(b) for a, b in zip(results['brute'][2], results['tree'][2])) and \
+            all(set(a) == set(b) for a, b in zip(results['brute'][3], results['tree'][3]))
+        out.write('%10d %10.3f %12.1f %12.1f %12.1f %12.1f %8s\n' %
+                  (size, build, 1e6*results['brute'][0]/args.queries, 1e6*results['tree'][0]/args.queries,
+                   1e6*results['brute'][1]/args.queries, 1e6*results['tree'][1]/args.queries, same))
+
+if __name__ == '__main__':
+    main()
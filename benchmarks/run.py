@@ -0,0 +1,203 @@
+'''
+Load driver: replays a stream of bibcodes against create_app(), with synthetic
+data in an SQLite database and a local stand-in for Solr, and reports the
+throughput, the latency percentiles (overall and per pipeline stage) and the
+memory used.
+
+    python -m benchmarks.run --data /tmp/recommender-bench --generate --threads 8
+
+The bibcode stream is read from --requests: a file with a bibcode per line, or
+JSON lines with a 'bibcode' field (default: the stream generated with the data).
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import threading
+import simplejson as json
+import numpy as np
+from benchmarks import synthetic
+from benchmarks.fake_solr import FakeSolr
+
+def read_stream(path):
+    '''
+    Read bibcodes from a file with a bibcode per line, or JSON lines with a 'bibcode' field
+    '''
+    bibcodes = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                line = json.loads(line).get('bibcode')
+            if line:
+                bibcodes.append(str(line))
+    return bibcodes
+
+def write_settings(args, solr):
+    '''
+    Write the settings for the application under test, and point RECOMMENDER_SETTINGS to them
+    '''
+    settings = {
+        'SOLRQUERY_URL': solr.url,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % os.path.join(args.data, 'recommender.db'),
+        'CLUSTER_COORDINATES_PATH': os.path.join(args.data, 'coordinates'),
+        'CLUSTER_TREES_PATH': os.path.join(args.data, 'trees'),
+        'COREADS_PATH': os.path.join(args.data, 'coreads'),
+        'MODEL_ARENA_PATH': os.path.join(args.data, 'model'),
+        'VECTOR_CACHE_PATH': os.path.join(args.data, 'vectors.db'),
+        'PRECOMPUTED_RECOMMENDATIONS': os.path.join(args.data, 'recommendations.db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    }
+    if args.no_result_cache:
+        settings['RESULT_CACHE_SIZE'] = 0
+    if args.tree_min_size is not None:
+        settings['CLUSTER_TREE_MIN_SIZE'] = args.tree_min_size
+    path = os.path.join(args.data, 'settings.py')
+    with open(path, 'w') as f:
+        for key, value in sorted(settings.items()):
+            f.write('%s = %r\n' % (key, value))
+    os.environ['RECOMMENDER_SETTINGS'] = path
+
+def parse_timing(header):
+    '''
+    Parse an X-Timing header ('stage=milliseconds, ...') into a dictionary of seconds per stage
+    '''
+    timings = {}
+    for item in filter(None, (header or '').split(', ')):
+        stage, ms = item.rsplit('=', 1)
+        timings[stage] = float(ms)/1000
+    return timings
+
+def drive(app, bibcodes, threads):
+    '''
+    Request recommendations for all bibcodes, from a number of concurrent threads.
+    Returns the latencies, the response status codes and the time spent in each
+    pipeline stage by each request (from the X-Timing header), as a dictionary of
+    lists per stage.
+    '''
+    latencies = []
+    statuses = []
+    stages = {}
+    stream = iter(bibcodes)
+    lock = threading.Lock()
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                bibcode = next(stream, None)
+            if bibcode is None:
+                return
+            started = time.time()
+            resp = client.get('/%s?timing=1' % bibcode)
+            elapsed = time.time() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(resp.status_code)
+                for stage, t in parse_timing(resp.headers.get('X-Timing')).items():
+                    stages.setdefault(stage, []).append(t)
+    pool = [threading.Thread(target=worker) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return np.array(latencies), statuses, dict((stage, np.array(t)) for stage, t in stages.items())
+
+def report(args, elapsed, latencies, statuses, stages, metrics, solr):
+    out = sys.stdout
+    out.write('requests:    %s in %.2fs with %s threads (%.1f requests/s)\n' %
+              (len(latencies), elapsed, args.threads, len(latencies)/elapsed))
+    out.write('status:      %s\n' % ', '.join('%s: %s' % (s, statuses.count(s)) for s in sorted(set(statuses))))
+    out.write('latency:     p50 %.1fms, p95 %.1fms, p99 %.1fms, max %.1fms\n' %
+              tuple(1000*x for x in np.percentile(latencies, [50, 95, 99, 100])))
+    out.write('memory:      %.1f MB max resident\n' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0))
+    out.write('solr:        %s queries\n' % solr.queries)
+    # exact percentiles of the time per request in each stage (the /metrics histograms only have bucket bounds)
+    out.write('\n%-30s %8s %10s %10s %10s %10s\n' % ('stage', 'requests', 'mean (ms)', 'p50', 'p95', 'p99'))
+    for stage, t in sorted(stages.items()):
+        out.write('%-30s %8d %10.2f %10.2f %10.2f %10.2f\n' %
+                  ((stage, len(t), 1000*t.mean()) + tuple(1000*x for x in np.percentile(t, [50, 95, 99]))))
+    out.write('\n')
+    for name, value in sorted(metrics['counters'].items()):
+        out.write('%-30s %10s\n' % (name, value))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the recommender service on synthetic data')
+    parser.add_argument('--data', required=True, help='Directory with the synthetic data')
+    parser.add_argument('--generate', action='store_true', help='(Re)generate the synthetic data')
+    parser.add_argument('--papers', type=int, default=20000, help='Number of papers to generate')
+    parser.add_argument('--requests', help='File with the bibcode stream to replay')
+    parser.add_argument('--count', type=int, default=1000, help='Number of requests')
+    parser.add_argument('--threads', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--solr-latency', type=float, default=0.01, help='Latency of every Solr query (seconds)')
+    parser.add_argument('--solr-jitter', type=float, default=0.01, help='Maximum random extra latency (seconds)')
+    parser.add_argument('--no-result-cache', action='store_true', help='Recompute every request')
+    parser.add_argument('--trees', action='store_true', help='Search large clusters with KD-trees')
+    parser.add_argument('--tree-min-size', type=int, help='Minimum cluster size for a KD-tree')
+    parser.add_argument('--coreads', action='store_true', help='Aggregate the coreads in the binary coreads store')
+    parser.add_argument('--warm-vectors', action='store_true', help='Fill the paper vector cache for the bibcode stream first')
+    parser.add_argument('--precompute', action='store_true', help='Precompute the recommendations first')
+    parser.add_argument('--json', help='Also write the report as JSON to this file')
+    args = parser.parse_args()
+
+    if args.generate or not os.path.exists(os.path.join(args.data, 'solr.json')):
+        started = time.time()
+        synthetic.generate(args.data, papers=args.papers)
+        if os.path.exists(os.path.join(args.data, 'coordinates')):
+            shutil.rmtree(os.path.join(args.data, 'coordinates'))
+        sys.stdout.write('generated %s papers in %.1fs\n' % (args.papers, time.time() - started))
+    with open(os.path.join(args.data, 'solr.json')) as f:
+        solr = FakeSolr(json.load(f), latency=args.solr_latency, jitter=args.solr_jitter).start()
+    write_settings(args, solr)
+    if os.path.exists(os.path.join(args.data, 'recommendations.db')) and not args.precompute:
+        os.remove(os.path.join(args.data, 'recommendations.db'))
+    for name in ('trees', 'coreads', 'model'):
+        if os.path.exists(os.path.join(args.data, name)):
+            shutil.rmtree(os.path.join(args.data, name))
+    for name in ('vectors.db', 'vectors.db-wal', 'vectors.db-shm'):
+        if os.path.exists(os.path.join(args.data, name)):
+            os.remove(os.path.join(args.data, name))
+
+    bibcodes = read_stream(args.requests or os.path.join(args.data, 'bibcodes.txt'))
+    bibcodes = (bibcodes*(args.count//max(len(bibcodes), 1) + 1))[:args.count]
+
+    from recommender import app as recommender
+    app = recommender.create_app()
+    with app.app_context():
+        # load the model data up front, so that it does not count for the first requests
+        data = app.model.load().coordinates.current()
+        if args.trees:
+            from recommender.utils.trees import build_trees
+            build_trees(data, data['version'], app.config['CLUSTER_TREES_PATH'], app.config['CLUSTER_TREE_MIN_SIZE'])
+            app.model.load()
+        if args.coreads:
+            from recommender.utils.coreads import build_coreads
+            build_coreads(app.config['COREADS_PATH'])
+        if args.warm_vectors:
+            from recommender.utils.recommender import warm_vector_cache
+            warm_vector_cache(sorted(set(bibcodes)))
+        if args.precompute:
+            from recommender.utils.precompute import precompute_recommendations
+            precompute_recommendations(app.config['PRECOMPUTED_RECOMMENDATIONS'])
+
+    solr.queries = 0
+    started = time.time()
+    latencies, statuses, stages = drive(app, bibcodes, args.threads)
+    elapsed = time.time() - started
+    metrics = json.loads(app.test_client().get('/metrics').data)
+    report(args, elapsed, latencies, statuses, stages, metrics, solr)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'requests': len(latencies), 'elapsed': elapsed, 'threads': args.threads,
+                       'latency': dict(('p%s' % q, float(np.percentile(latencies, q))) for q in (50, 95, 99)),
+                       'stages': dict((stage, dict(('p%s' % q, float(np.percentile(t, q))) for q in (50, 95, 99)))
+                                      for stage, t in stages.items()),
+                       'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       'metrics': metrics}, f, indent=2)
+    solr.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Synthetic data for benchmarking: papers with keywords, references and citations
+(the Solr corpus), and the 'clusters', 'clustering' and 'coreads' tables. The data
+is dimensioned after the shipped projection matrices: papers are assigned to the
+clusters that have a projection matrix, their 100-dimensional vectors are the
+projections of their keyword vectors and their low-dimensional coordinates the
+cluster-specific projections of those.
+'''
+import os
+import simplejson as json
+import numpy as np
+from sqlalchemy import create_engine
+from recommender import app as recommender
+from recommender.utils.definitions import ASTkeywords
+from recommender.utils.database import db, CoReads, Clustering, Clusters
+from recommender.utils.projections import ProjectionRegistry
+
+PROJECTION_PATH = os.path.join(os.path.dirname(recommender.__file__), 'utils/data/clusters')
+
+def make_bibcode(i):
+    return '%04dBENCH%010d' % (1980 + i % 35, i)
+
+def generate(path, papers=20000, keywords=8, references=30, coreads=20, topic_size=40,
+             unclustered=0.1, stream=10000, seed=42):
+    '''
+    Generate a data set in the directory 'path':
+
+      solr.json       the Solr documents of all papers
+      recommender.db  SQLite database with the clusters, clustering and coreads tables
+      bibcodes.txt    a stream of bibcodes to request, with a skewed popularity
+
+    A fraction 'unclustered' of the papers is left out of the clustering, like new
+    papers, so that they are assigned to a cluster by their centroid distance.
+    '''
+    rng = np.random.RandomState(seed)
+    projections = ProjectionRegistry(PROJECTION_PATH)
+    clusters = sorted(c for c in projections.matrices if c >= 0)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    bibcodes = [make_bibcode(i) for i in range(papers)]
+    cluster_of = rng.choice(clusters, papers)
+    members = dict((c, np.flatnonzero(cluster_of == c)) for c in clusters)
+    # Every cluster has a topic: the keywords its papers mostly have
+    topics = dict((c, rng.choice(len(ASTkeywords), topic_size, replace=False)) for c in clusters)
+
+    # Solr corpus. References are mostly to (older) papers in the same cluster.
+    docs = []
+    citations = [[] for i in range(papers)]
+    for i, bibcode in enumerate(bibcodes):
+        c = cluster_of[i]
+        kw = np.where(rng.rand(keywords) < 0.8, rng.choice(topics[c], keywords), rng.randint(len(ASTkeywords), size=keywords))
+        same = rng.choice(members[c], references)
+        other = rng.randint(papers, size=references)
+        refs = sorted(set(np.where(rng.rand(references) < 0.8, same, other)) - set([i]))
+        for j in refs:
+            citations[j].append(bibcode)
+        docs.append({'bibcode': bibcode,
+                     'title': ['Synthetic paper %s' % i],
+                     'first_author': 'Author%s, A.' % rng.randint(1000),
+                     'pubdate': '%s-%02d-00' % (bibcode[:4], rng.randint(1, 13)),
+                     'keyword_norm': sorted(set(ASTkeywords[k] for k in kw)),
+                     'reference': [bibcodes[j] for j in refs]})
+    for doc, citing in zip(docs, citations):
+        if citing:
+            doc['citation'] = citing
+            doc['citation_count'] = len(citing)
+    with open(os.path.join(path, 'solr.json'), 'w') as f:
+        json.dump(docs, f)
+
+    # The paper vectors, as the service computes them: the keywords of a paper and its references
+    index = dict((keyword, i) for i, keyword in enumerate(ASTkeywords))
+    pvecs = np.zeros((papers, projections.get().shape[1]))
+    for start in range(0, papers, 1000):
+        block = np.zeros((min(1000, papers - start), len(ASTkeywords)))
+        for i in range(start, start + len(block)):
+            for doc in [docs[i]] + [docs[int(ref[9:])] for ref in docs[i]['reference']]:
+                for keyword in doc['keyword_norm']:
+                    block[i - start, index[keyword]] += 1
+        block /= np.maximum(block.sum(axis=1), 1)[:, np.newaxis]
+        pvecs[start:start + len(block)] = np.dot(block, projections.get())
+    clustered = rng.rand(papers) >= unclustered
+
+    engine = create_engine('sqlite:///%s' % os.path.join(path, 'recommender.db'))
+    db.Model.metadata.drop_all(engine, tables=[CoReads.__table__, Clustering.__table__, Clusters.__table__])
+    db.Model.metadata.create_all(engine, tables=[CoReads.__table__, Clustering.__table__, Clusters.__table__])
+    rows = []
+    for c in clusters:
+        idx = members[c][clustered[members[c]]]
+        centroid = pvecs[members[c]].mean(axis=0) if len(members[c]) else np.zeros(pvecs.shape[1])
+        rows.append({'cluster': int(c), 'members': [bibcodes[i] for i in idx], 'centroid': centroid.tolist()})
+    engine.execute(Clusters.__table__.insert(), rows)
+    rows = [{'bibcode': bibcodes[i], 'cluster': int(cluster_of[i]), 'vector': pvecs[i].tolist(),
+             'vector_low': np.dot(pvecs[i], projections.get(cluster_of[i])).tolist()}
+            for i in range(papers) if clustered[i]]
+    engine.execute(Clustering.__table__.insert(), rows)
+
+    # Coreads: papers read before and after, mostly in the same cluster
+    rows = []
+    for i, bibcode in enumerate(bibcodes):
+        c = cluster_of[i]
+        data = {}
+        for key in ('before', 'after'):
+            reads = np.where(rng.rand(coreads) < 0.8, rng.choice(members[c], coreads), rng.randint(papers, size=coreads))
+            data[key] = [[bibcodes[j], int(rng.randint(1, 20))] for j in sorted(set(reads) - set([i]))]
+        rows.append({'bibcode': bibcode, 'coreads': data})
+    engine.execute(CoReads.__table__.insert(), rows)
+
+    # The request stream: paper popularity follows a power law
+    popular = rng.permutation(papers)
+    with open(os.path.join(path, 'bibcodes.txt'), 'w') as f:
+        for rank in np.minimum(rng.zipf(1.3, stream), papers) - 1:
+            f.write('%s\n' % bibcodes[popular[rank]])
+    return papers
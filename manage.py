@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    manage
+    ~~~~~~
+
+    command line tasks for building the data the recommender service runs on
+"""
+
+import os
+import argparse
+from collections import Counter
+
+from recommender import app as recommender
+from recommender.utils.coordinates import build_snapshot, snapshot_lock, CoordinateSnapshot
+from recommender.utils.trees import build_trees
+from recommender.utils.coreads import build_coreads
+from recommender.utils.recommender import warm_vector_cache
+from recommender.utils.precompute import precompute_recommendations
+
+def build_coordinates(app, args):
+  path = args.path or os.path.join(os.path.dirname(recommender.__file__), app.config['CLUSTER_COORDINATES_PATH'])
+  with snapshot_lock(path):
+    n = build_snapshot(path)
+  print 'Wrote coordinates of %s papers to %s' % (n, path)
+  #The trees are only valid for the snapshot they were built from
+  if not args.no_trees:
+    write_trees(app, path)
+
+def build_cluster_trees(app, args):
+  path = args.path or os.path.join(os.path.dirname(recommender.__file__), app.config['CLUSTER_COORDINATES_PATH'])
+  write_trees(app, path, output=args.output, min_size=args.min_size)
+
+def write_trees(app, path, output=None, min_size=None):
+  output = output or os.path.join(os.path.dirname(recommender.__file__), app.config['CLUSTER_TREES_PATH'])
+  if min_size is None:
+    min_size = app.config['CLUSTER_TREE_MIN_SIZE']
+  data = CoordinateSnapshot(path).load()
+  with snapshot_lock(path):
+    n = build_trees(data, data['version'], output, min_size)
+  print 'Wrote KD-trees of %s clusters (with at least %s members) to %s' % (n, min_size, output)
+
+def build_coreads_store(app, args):
+  path = args.path or os.path.join(os.path.dirname(recommender.__file__), app.config['COREADS_PATH'])
+  n = build_coreads(path)
+  print 'Wrote coreads of %s papers to %s' % (n, path)
+
+def warm_vectors(app, args):
+  #The file can be a log of requested bibcodes: the most requested ones come first
+  with open(args.bibcodes) as f:
+    requested = Counter(line.strip() for line in f if line.strip())
+  biblist = [bibcode for bibcode, n in requested.most_common(args.top)]
+  n = warm_vector_cache(biblist, batch_size=args.batch_size)
+  print 'Cached paper vectors of %s papers (of %s requested)' % (n, len(biblist))
+
+def precompute(app, args):
+  path = args.path or os.path.join(os.path.dirname(recommender.__file__), app.config['PRECOMPUTED_RECOMMENDATIONS'])
+  n, failed = precompute_recommendations(path, processes=args.processes, batch_size=args.batch_size)
+  print 'Wrote recommendations for %s papers to %s (%s failed)' % (n, path, failed)
+
+def main():
+  parser = argparse.ArgumentParser(description='Recommender service tasks')
+  commands = parser.add_subparsers()
+
+  cmd = commands.add_parser('build-coordinates', help='Snapshot the low-dimensional coordinates from the clustering table')
+  cmd.add_argument('--path', help='Output directory (default: CLUSTER_COORDINATES_PATH)')
+  cmd.add_argument('--no-trees', action='store_true', help='Do not rebuild the KD-trees of the clusters')
+  cmd.set_defaults(func=build_coordinates)
+
+  cmd = commands.add_parser('build-trees', help='Build the KD-trees of the clusters from the coordinate snapshot')
+  cmd.add_argument('--path', help='Coordinate snapshot (default: CLUSTER_COORDINATES_PATH)')
+  cmd.add_argument('--output', help='Output directory (default: CLUSTER_TREES_PATH)')
+  cmd.add_argument('--min-size', type=int, default=None, help='Minimum cluster size (default: CLUSTER_TREE_MIN_SIZE)')
+  cmd.set_defaults(func=build_cluster_trees)
+
+  cmd = commands.add_parser('build-coreads', help='Convert the coreads table to a binary store with interned bibcodes')
+  cmd.add_argument('--path', help='Output directory (default: COREADS_PATH)')
+  cmd.set_defaults(func=build_coreads_store)
+
+  cmd = commands.add_parser('warm-vectors', help='Fill the paper vector cache for the most requested bibcodes')
+  cmd.add_argument('bibcodes', help='File with a bibcode per line, e.g. every requested bibcode')
+  cmd.add_argument('--top', type=int, default=None, help='Only this many most requested bibcodes')
+  cmd.add_argument('--batch-size', type=int, default=100, help='Number of papers retrieved together')
+  cmd.set_defaults(func=warm_vectors)
+
+  cmd = commands.add_parser('precompute', help='Compute the recommendations for all clustered papers')
+  cmd.add_argument('--path', help='Output file (default: PRECOMPUTED_RECOMMENDATIONS)')
+  cmd.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: number of CPUs)')
+  cmd.add_argument('--batch-size', type=int, default=100, help='Number of papers computed together')
+  cmd.set_defaults(func=precompute)
+
+  args = parser.parse_args()
+  app = recommender.create_app()
+  with app.app_context():
+    args.func(app, args)
+
+if __name__ == "__main__":
+  main()
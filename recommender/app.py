@@ -1,10 +1,20 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from flask import Blueprint
 from flask import Flask, g
-from views import blueprint, Resources, Recommender
+from views import blueprint, Resources, Recommender, BatchRecommender, Metrics as MetricsResource, Model, Ready
 from flask.ext.restful import Api
 from client import Client
 from utils.database import db
+from utils.model import ModelManager
+from utils.coreads import CoreadsStore
+from utils.cache import LRUCache, ResultCache
+from utils.store import RecommendationStore
+from utils.vectors import VectorCache
+from utils.metrics import Metrics
+from werkzeug.utils import import_string
+
+_basedir = os.path.abspath(os.path.dirname(__file__))
 
 def create_app(blueprint_only=False):
   app = Flask(__name__, static_folder=None)
@@ -15,10 +25,32 @@ def create_app(blueprint_only=False):
     app.config.from_pyfile('local_config.py')
   except IOError:
     pass
+  #Settings file given in the environment, e.g. by the benchmarks
+  app.config.from_envvar('RECOMMENDER_SETTINGS', silent=True)
+  app.metrics = Metrics()
   app.client = Client(app.config['CLIENT'])
+  app.executor = ThreadPoolExecutor(max_workers=app.config['EXECUTOR_WORKERS'])
+  app.model = ModelManager(os.path.join(_basedir, app.config['CLUSTER_PROJECTION_PATH']),
+    os.path.join(_basedir, app.config['CLUSTER_COORDINATES_PATH']), trees_path=os.path.join(_basedir, app.config['CLUSTER_TREES_PATH']),
+    min_tree_size=app.config['CLUSTER_TREE_MIN_SIZE'], refresh=app.config['MODEL_REFRESH'],
+    arena_path=os.path.join(_basedir, app.config['MODEL_ARENA_PATH']))
+  app.coreads = CoreadsStore(os.path.join(_basedir, app.config['COREADS_PATH']))
+  app.metadata_cache = LRUCache(maxsize=app.config['METADATA_CACHE_SIZE'], ttl=app.config['METADATA_CACHE_TTL'],
+                                maxbytes=app.config['METADATA_CACHE_MAXBYTES'])
+  app.vector_cache = VectorCache(os.path.join(_basedir, app.config['VECTOR_CACHE_PATH']), ttl=app.config['VECTOR_CACHE_TTL'],
+                                 maxsize=app.config['VECTOR_CACHE_SIZE'], projected=app.config['VECTOR_CACHE_PROJECTED'])
+  backend = None
+  if app.config['RESULT_CACHE_BACKEND']:
+    backend = import_string(app.config['RESULT_CACHE_BACKEND'])(**app.config['RESULT_CACHE_BACKEND_OPTIONS'])
+  app.precomputed = RecommendationStore(os.path.join(_basedir, app.config['PRECOMPUTED_RECOMMENDATIONS']))
+  app.result_cache = ResultCache(backend=backend, ttl=app.config['RESULT_CACHE_TTL'], maxsize=app.config['RESULT_CACHE_SIZE'])
 
   api = Api(blueprint)
   api.add_resource(Resources, '/resources')
+  api.add_resource(MetricsResource, '/metrics')
+  api.add_resource(BatchRecommender, '/batch')
+  api.add_resource(Model, '/model')
+  api.add_resource(Ready, '/ready')
   api.add_resource(Recommender, '/<string:bibcode>')
 
   if blueprint_only:
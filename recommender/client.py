@@ -1,4 +1,9 @@
+import time
 import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectTimeout
 
 class Client:
   '''The Client class is a thin wrapper around requests; Use it as a centralized place to set
@@ -6,7 +11,53 @@ class Client:
 
   def __init__(self,client_config,send_oauth2_token=True):
     self.config = client_config
+    #(connect, read) timeouts in seconds, applied to every call made through get()
+    self.timeout = self.config.get('TIMEOUT', (3.05, 30))
     self.session = requests.Session()
+    #Keep enough connections alive for all threads that query concurrently
+    adapter = HTTPAdapter(pool_connections=self.config.get('POOL_CONNECTIONS', 10), pool_maxsize=self.config.get('POOL_SIZE', 20))
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    self.session.headers.update({'Connection': 'keep-alive'})
+    #Bound the number of queries in flight, so that many concurrent requests do not overwhelm Solr
+    self.slots = threading.BoundedSemaphore(self.config.get('MAX_CONCURRENCY', self.config.get('POOL_SIZE', 20)))
+    #Threads for running batches of a bulk query concurrently
+    self.executor = ThreadPoolExecutor(max_workers=self.config.get('MAX_WORKERS', 10))
     if send_oauth2_token:
       self.token = self.config['TOKEN'] #Better to raise KeyError than default to an unusable token
       self.session.headers.update({'Authorization': 'Bearer %s' % self.token})
+
+  def acquire(self, wait=None):
+    '''Take a query slot, waiting at most 'wait' seconds for one to be free (as long as it takes if None).
+    Returns the number of seconds waited; raises a requests Timeout if no slot is free in time'''
+    started = time.time()
+    if wait is None:
+      self.slots.acquire()
+      return time.time() - started
+    #Semaphores cannot wait with a timeout in Python 2: poll, backing off like threading.Condition.wait
+    delay = 0.0005
+    while not self.slots.acquire(False):
+      left = started + wait - time.time()
+      if left <= 0:
+        raise ConnectTimeout('No free Solr query slot within %.3f seconds' % wait)
+      time.sleep(min(delay, left))
+      delay = min(2*delay, 0.05)
+    return time.time() - started
+
+  def request(self, method, url, slot_timeout=None, **kwargs):
+    '''Make a call in a query slot. With 'slot_timeout', waiting for a slot takes at most that many seconds,
+    which are taken off the timeout of the call'''
+    kwargs.setdefault('timeout', self.timeout)
+    waited = self.acquire(slot_timeout)
+    try:
+      if slot_timeout is not None:
+        kwargs['timeout'] = tuple(max(t - waited, 0.001) for t in kwargs['timeout'])
+      return self.session.request(method, url, **kwargs)
+    finally:
+      self.slots.release()
+
+  def get(self, url, **kwargs):
+    return self.request('GET', url, **kwargs)
+
+  def post(self, url, **kwargs):
+    return self.request('POST', url, **kwargs)
@@ -9,7 +9,73 @@ SQLALCHEMY_RECOMMENDER_DATABASE_URI = ''
 THRESHOLD_FREQUENCY = 1
 SOLRQUERY_URL = 'http://adswhy:9000/solr/collection1/select'
 CLUSTER_PROJECTION_PATH = 'utils/data/clusters'
+#Number of seconds after which a new snapshot of the cluster model (projection matrices, clusters and
+#coordinates) is loaded in the background; POST /model loads one right away, rebuilding the clusters and
+#coordinates from the database
+MODEL_REFRESH = 3600
+#Arena with the centroids and cluster membership as flat arrays, memory-mapped by all worker processes
+#instead of a copy per worker. It is built by the first process that loads the model (e.g. before
+#the workers fork, with gunicorn --preload) and attached to by the others; a directory in /dev/shm
+#keeps it in memory
+MODEL_ARENA_PATH = 'utils/data/model'
+#Snapshot of the low-dimensional coordinates of clustered papers (see manage.py build-coordinates)
+CLUSTER_COORDINATES_PATH = 'utils/data/coordinates'
+#Per-cluster KD-trees over the snapshot coordinates (see manage.py build-trees). Clusters with at least
+#CLUSTER_TREE_MIN_SIZE members are searched with their tree, smaller clusters by brute force
+CLUSTER_TREES_PATH = 'utils/data/clusters/trees'
+CLUSTER_TREE_MIN_SIZE = 1000
+#Binary store of the coreads, with interned bibcodes (see manage.py build-coreads). Without it,
+#the coreads are read from the database
+COREADS_PATH = 'utils/data/coreads'
+#Lookup table with precomputed recommendations for clustered papers (see manage.py precompute)
+PRECOMPUTED_RECOMMENDATIONS = 'utils/data/recommendations.db'
+#Per-bibcode cache of article metadata: maximum number of entries, time to live (seconds)
+#and maximum (approximate) size in bytes
+METADATA_CACHE_SIZE = 100000
+METADATA_CACHE_TTL = 24*60*60
+METADATA_CACHE_MAXBYTES = 256*1024*1024
+#Persistent cache of paper vectors (keyword frequencies of a paper and its references), to save the
+#keywords query to Solr: file, time to live (seconds) and maximum number of entries (0 disables it).
+#With VECTOR_CACHE_PROJECTED the projections onto the 100-dimensional space are cached as well, for the
+#version of the cluster model they were made with; after a new model is loaded, they are made again
+#from the cached paper vectors. See manage.py warm-vectors
+VECTOR_CACHE_PATH = 'utils/data/vectors.db'
+VECTOR_CACHE_TTL = 30*24*60*60
+VECTOR_CACHE_SIZE = 1000000
+VECTOR_CACHE_PROJECTED = False
+#Cache of recommendation results: time to live (seconds) and maximum number of entries.
+#By default results are cached in-process; to share them between worker processes, set
+#RESULT_CACHE_BACKEND to the import path of a class with get(key) and set(key, value, ttl)
+#methods, which is instantiated with RESULT_CACHE_BACKEND_OPTIONS as keyword arguments
+RESULT_CACHE_TTL = 60*60
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_BACKEND = None
+RESULT_CACHE_BACKEND_OPTIONS = {}
+#Latency budget of a request, in seconds (None: no deadline). The optional recommendations (most recent,
+#most cited, citing and cited papers) that cannot be found within it are left out, and the result is marked
+#'partial' (and not cached). The Solr calls of the optional stages get timeouts of at most the time left;
+#they have to finish REQUEST_MIN_TIMEOUT seconds before the deadline, which are kept for the calls needed
+#for any result. Those keep the CLIENT timeout, so a slow request is not turned into an error
+REQUEST_DEADLINE = 2.0
+BATCH_REQUEST_DEADLINE = 30.0
+REQUEST_MIN_TIMEOUT = 0.5
+#Number of threads used to run independent stages of the recommendation pipeline concurrently
+EXECUTOR_WORKERS = 10
+#Asynchronous serving mode (wsgi_async.py): maximum number of requests in flight, number of
+#threads for CPU-bound (NumPy) work and number of database connections
+ASYNC_MAX_REQUESTS = 1000
+ASYNC_CPU_THREADS = 4
+ASYNC_DB_CONNECTIONS = 20
 #This section configures this application to act as a client, for example to query solr via adsws
 CLIENT = {
-  'TOKEN': 'we will provide an api key token for this application'
+  'TOKEN': 'we will provide an api key token for this application',
+  #Number of connections kept alive to Solr; should be at least the number of threads querying it
+  'POOL_SIZE': 20,
+  #Maximum number of concurrent Solr queries (defaults to POOL_SIZE); further queries wait for a free slot
+  #(in the optional stages of a request, at most until the deadline: see REQUEST_DEADLINE)
+  'MAX_CONCURRENCY': 20,
+  #Number of threads for running the batches of bulk Solr queries (of CHUNK_SIZE bibcodes each) concurrently
+  'MAX_WORKERS': 10,
+  #(connect, read) timeouts for Solr queries, in seconds
+  'TIMEOUT': (3.05, 30),
 }
@@ -0,0 +1,90 @@
+'''
+Test fixtures: the application, running on a small synthetic data set (see
+benchmarks.synthetic) with a local stand-in for Solr
+'''
+import os
+import atexit
+import shutil
+import tempfile
+import simplejson as json
+from flask.ext.testing import TestCase
+from benchmarks import synthetic
+from benchmarks.fake_solr import FakeSolr
+
+PAPERS = 400
+
+_fixture = {}
+
+def data_path():
+    '''
+    Return the directory with the synthetic data, generating it on first use
+    '''
+    if 'path' not in _fixture:
+        path = tempfile.mkdtemp(prefix='recommender-tests-')
+        atexit.register(shutil.rmtree, path, True)
+        synthetic.generate(path, papers=PAPERS, stream=200)
+        _fixture['path'] = path
+    return _fixture['path']
+
+def get_app():
+    '''
+    Return the application under test. It is created once per process (the views
+    are registered on a global blueprint), without deadlines and with the result
+    and paper vector caches disabled, so that every request is computed.
+    '''
+    if 'app' not in _fixture:
+        path = data_path()
+        with open(os.path.join(path, 'solr.json')) as f:
+            solr = FakeSolr(json.load(f)).start()
+        atexit.register(solr.shutdown)
+        _fixture['solr'] = solr
+        settings = {
+            'SOLRQUERY_URL': solr.url,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % os.path.join(path, 'recommender.db'),
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+            'CLUSTER_COORDINATES_PATH': os.path.join(path, 'coordinates'),
+            'CLUSTER_TREES_PATH': os.path.join(path, 'trees'),
+            'COREADS_PATH': os.path.join(path, 'coreads'),
+            'MODEL_ARENA_PATH': os.path.join(path, 'model'),
+            'VECTOR_CACHE_PATH': os.path.join(path, 'vectors.db'),
+            'VECTOR_CACHE_SIZE': 0,
+            'PRECOMPUTED_RECOMMENDATIONS': os.path.join(path, 'recommendations.db'),
+            'RESULT_CACHE_SIZE': 0,
+            'REQUEST_DEADLINE': None,
+            'BATCH_REQUEST_DEADLINE': None,
+        }
+        with open(os.path.join(path, 'settings.py'), 'w') as f:
+            for key, value in sorted(settings.items()):
+                f.write('%s = %r\n' % (key, value))
+        os.environ['RECOMMENDER_SETTINGS'] = os.path.join(path, 'settings.py')
+        from recommender.app import create_app
+        app = create_app()
+        app.config['TESTING'] = True
+        _fixture['app'] = app
+    return _fixture['app']
+
+def get_solr():
+    '''
+    Return the Solr stand-in used by the application under test
+    '''
+    get_app()
+    return _fixture['solr']
+
+def bibcodes():
+    '''
+    The distinct bibcodes of the request stream of the synthetic data, in order of
+    first request
+    '''
+    seen = []
+    with open(os.path.join(data_path(), 'bibcodes.txt')) as f:
+        for line in f:
+            if line.strip() not in seen:
+                seen.append(line.strip())
+    return seen
+
+class AppTestCase(TestCase):
+    '''
+    Test case running in an application context of the application under test
+    '''
+    def create_app(self):
+        return get_app()
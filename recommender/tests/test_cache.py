@@ -0,0 +1,63 @@
+import time
+import unittest
+import threading
+from recommender.utils.cache import LRUCache, ResultCache
+
+class TestResultCache(unittest.TestCase):
+
+    def test_concurrent_requests_are_coalesced(self):
+        cache = ResultCache(ttl=60, maxsize=10)
+        release = threading.Event()
+        calls = []
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return {'result': 42}
+        results = []
+        def request():
+            results.append(cache.get_or_compute('key', compute))
+        leader = threading.Thread(target=request)
+        leader.start()
+        while 'key' not in cache.inflight:
+            time.sleep(0.001)
+        followers = [threading.Thread(target=request) for i in range(5)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([value for value, status in results], [{'result': 42}]*6)
+        statuses = sorted(status for value, status in results)
+        self.assertEqual(statuses, [ResultCache.COALESCED]*5 + [ResultCache.MISS])
+        self.assertEqual(cache.get_or_compute('key', compute), ({'result': 42}, ResultCache.HIT))
+        self.assertEqual(cache.inflight, {})
+
+    def test_failures_are_shared_and_not_cached(self):
+        cache = ResultCache(ttl=60, maxsize=10)
+        def fail():
+            raise ValueError('failed')
+        self.assertRaises(ValueError, cache.get_or_compute, 'key', fail)
+        self.assertEqual(cache.inflight, {})
+        self.assertEqual(cache.get_or_compute('key', lambda: 1), (1, ResultCache.MISS))
+
+    def test_uncacheable_results(self):
+        cache = ResultCache(ttl=60, maxsize=10)
+        partial = lambda: {'partial': True}
+        cacheable = lambda r: not r.get('partial')
+        self.assertEqual(cache.get_or_compute('key', partial, cacheable=cacheable)[1], ResultCache.MISS)
+        self.assertEqual(cache.get_or_compute('key', partial, cacheable=cacheable)[1], ResultCache.MISS)
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+if __name__ == '__main__':
+    unittest.main()
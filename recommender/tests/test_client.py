@@ -0,0 +1,30 @@
+import time
+import unittest
+from requests.exceptions import Timeout
+from recommender.client import Client
+from recommender.tests.base import get_solr
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client({'MAX_CONCURRENCY': 1}, send_oauth2_token=False)
+        self.url = get_solr().url
+
+    def test_request(self):
+        resp = self.client.get(self.url, params={'q': 'bibcode:1999UNKNOWN', 'wt': 'json'}, slot_timeout=1.0)
+        self.assertEqual(resp.json()['response']['docs'], [])
+        # the slot is released again
+        self.assertTrue(self.client.slots.acquire(False))
+        self.client.slots.release()
+
+    def test_no_free_slot(self):
+        self.client.slots.acquire()
+        try:
+            started = time.time()
+            self.assertRaises(Timeout, self.client.get, self.url, slot_timeout=0.1)
+            self.assertTrue(0.1 <= time.time() - started < 1.0)
+        finally:
+            self.client.slots.release()
+
+if __name__ == '__main__':
+    unittest.main()
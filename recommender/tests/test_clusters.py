@@ -0,0 +1,41 @@
+import os
+import numpy as np
+from recommender.tests.base import AppTestCase, data_path
+from recommender.utils.clusters import ClusterIndex
+from recommender.utils.database import db, Clusters
+
+class TestClusterIndex(AppTestCase):
+
+    def setUp(self):
+        self.membership = {}
+        self.centroids = {}
+        for row in db.session.query(Clusters.cluster, Clusters.centroid, Clusters.members):
+            self.centroids[row.cluster] = np.array(row.centroid)
+            for bibcode in row.members or []:
+                self.membership[bibcode] = row.cluster
+        self.bibcodes = sorted(self.membership)[::7] + ['1999UNKNOWN', '', 'z'*40, u'2011B\xe9']
+        self.pvecs = np.random.RandomState(42).rand(len(self.bibcodes), 100)
+
+    def closest(self, pvec):
+        return min(self.centroids, key=lambda c: np.sum((self.centroids[c] - pvec)**2))
+
+    def check(self, index):
+        for bibcode, pvec in zip(self.bibcodes, self.pvecs):
+            self.assertEqual(index.lookup(bibcode), self.membership.get(bibcode))
+        self.assertEqual(index.nearest(self.pvecs[0]), self.closest(self.pvecs[0]))
+        expected = [self.membership.get(b, self.closest(p)) for b, p in zip(self.bibcodes, self.pvecs)]
+        self.assertEqual(index.assign(self.bibcodes, self.pvecs).tolist(), expected)
+
+    def test_in_memory(self):
+        self.check(ClusterIndex(refresh=None))
+
+    def test_arena(self):
+        path = os.path.join(data_path(), 'arena-test')
+        index = ClusterIndex(refresh=None, path=path)
+        self.check(index)
+        self.assertTrue(isinstance(index.current()[2], np.memmap))
+        # another process attaches to the arena instead of building its own
+        other = ClusterIndex(refresh=None, path=path)
+        other.load(max_age=3600)
+        self.assertEqual(other.built, index.built)
+        self.check(other)
@@ -0,0 +1,81 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from recommender.utils.coordinates import SNAPSHOT_FILES, CoordinateSnapshot
+from recommender.utils.trees import build_trees
+
+SIZES = {3: 5, 7: 60, 11: 400}
+
+class TestNearest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        rng = np.random.RandomState(42)
+        clusters = sorted(SIZES)
+        sizes = [SIZES[c] for c in clusters]
+        data = {
+            'bibcodes': np.array(['%sPAPER%05d' % (c, i) for c in clusters for i in range(SIZES[c])], dtype=str),
+            'coordinates': rng.rand(sum(sizes), 5).astype(np.float32),
+            'clusters': np.array(clusters, dtype=np.int32),
+            'offsets': np.concatenate(([0], np.cumsum(sizes))).astype(np.int64),
+        }
+        snapshot = os.path.join(self.path, 'coordinates')
+        os.makedirs(snapshot)
+        for name in SNAPSHOT_FILES:
+            np.save(os.path.join(snapshot, '%s.npy' % name), data[name])
+        with open(os.path.join(snapshot, 'built'), 'w') as f:
+            f.write('%f\n' % time.time())
+        self.brute = CoordinateSnapshot(snapshot)
+        data = self.brute.current()
+        build_trees(data, data['version'], os.path.join(self.path, 'trees'), 50)
+        self.trees = CoordinateSnapshot(snapshot, trees_path=os.path.join(self.path, 'trees'), min_tree_size=50)
+        self.vecs = rng.rand(30, 5)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_trees_are_loaded(self):
+        self.assertEqual(sorted(self.trees.current()['trees']), [7, 11])
+        self.assertEqual(self.brute.current()['trees'], {})
+
+    def assertNeighbours(self, pcluster, vec, k, neighbours):
+        '''
+        The neighbours must be the k closest members, closest first (members at
+        distances equal up to float32 round-off may be in either order)
+        '''
+        bibcodes, coordinates = self.brute.members(pcluster)
+        dist = dict(zip(bibcodes.tolist(), np.sum((coordinates.astype(np.float64) - vec)**2, axis=1)))
+        self.assertEqual(len(neighbours), min(k, len(bibcodes)))
+        self.assertEqual(len(set(neighbours)), len(neighbours))
+        np.testing.assert_allclose([dist[b] for b in neighbours], sorted(dist.values())[:k], atol=1e-5)
+
+    def test_nearest(self):
+        for pcluster in sorted(SIZES):
+            for k in (1, 10, 1000):
+                for vec in self.vecs:
+                    self.assertNeighbours(pcluster, vec, k, self.brute.nearest(pcluster, vec, k))
+                    self.assertNeighbours(pcluster, vec, k, self.trees.nearest(pcluster, vec, k))
+
+    def test_nearest_many(self):
+        for pcluster in sorted(SIZES):
+            for k in (1, 10, 1000):
+                for snapshot in (self.brute, self.trees):
+                    neighbours = snapshot.nearest_many(pcluster, self.vecs, k)
+                    self.assertEqual(len(neighbours), len(self.vecs))
+                    for vec, row in zip(self.vecs, neighbours):
+                        self.assertNeighbours(pcluster, vec, k, row)
+
+    def test_tree_matches_brute_force(self):
+        # away from round-off ties the results are the same
+        for pcluster in (7, 11):
+            self.assertEqual(self.trees.nearest_many(pcluster, self.vecs, 10), self.brute.nearest_many(pcluster, self.vecs, 10))
+
+    def test_unknown_cluster(self):
+        self.assertEqual(self.brute.nearest(5, self.vecs[0], 10), [])
+        self.assertEqual(self.trees.nearest_many(5, self.vecs[:2], 10), [[], []])
+
+if __name__ == '__main__':
+    unittest.main()
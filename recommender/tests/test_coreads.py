@@ -0,0 +1,40 @@
+import os
+import random
+from recommender.tests.base import AppTestCase, data_path
+from recommender.utils.coreads import build_coreads, CoreadsStore
+from recommender.utils.recommender import get_coreads, aggregate_coreads
+from recommender.utils.database import db, CoReads
+
+class TestCoreadsStore(AppTestCase):
+
+    def setUp(self):
+        self.path = os.path.join(data_path(), 'coreads-test')
+        build_coreads(self.path)
+        self.store = CoreadsStore(self.path)
+        self.bibcodes = sorted(row.bibcode for row in db.session.query(CoReads.bibcode))
+
+    def test_available(self):
+        self.assertTrue(self.store.available())
+        self.assertFalse(CoreadsStore(os.path.join(data_path(), 'missing')).available())
+
+    def test_aggregate_matches_aggregate_coreads(self):
+        rng = random.Random(42)
+        for i in range(100):
+            G = rng.sample(self.bibcodes, rng.randint(1, 40)) + ['1999UNKNOWN%s' % i]
+            remove = rng.choice([None, G[0], '1999UNKNOWN'])
+            self.assertEqual(self.store.aggregate(G, remove=remove), aggregate_coreads(G, get_coreads(G), remove=remove))
+
+    def test_no_coreads(self):
+        self.assertEqual(self.store.aggregate(['1999UNKNOWN']), ([], [], []))
+
+    def test_rebuilt_store_is_reloaded(self):
+        data = self.store.current()
+        self.assertTrue(self.store.current() is data)
+        build_coreads(self.path)
+        self.assertFalse(self.store.current() is data)
+        G = self.bibcodes[:10]
+        self.assertEqual(self.store.aggregate(G), aggregate_coreads(G, get_coreads(G)))
+
+    def test_non_ascii_bibcodes(self):
+        G = self.bibcodes[:10]
+        self.assertEqual(self.store.aggregate([u'1999\xc5UNKNOWN'] + G, remove=u'1999\xc5UNKNOWN'), self.store.aggregate(G))
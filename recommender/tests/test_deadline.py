@@ -0,0 +1,94 @@
+import time
+from flask import g, current_app
+from concurrent.futures import Future
+from requests.exceptions import ReadTimeout
+from recommender.tests.base import AppTestCase, bibcodes, get_solr
+from recommender.utils import deadline
+
+class TestDeadline(AppTestCase):
+
+    def counter(self, name):
+        return current_app.metrics.report()['counters'].get(name, 0)
+
+    def test_no_deadline(self):
+        deadline.start(None)
+        self.assertEqual(deadline.remaining(), None)
+        self.assertFalse(deadline.expired())
+        self.assertEqual(deadline.timeout((3.05, 30)), (3.05, 30))
+        self.assertEqual(deadline.optional(lambda x: x + 1, 1), 2)
+
+    def test_required_calls_keep_the_default_timeout(self):
+        deadline.start(1.0)
+        self.assertEqual(deadline.timeout((3.05, 30)), (3.05, 30))
+        deadline.start(-1.0)
+        self.assertEqual(deadline.timeout((3.05, 30)), (3.05, 30))
+
+    def test_optional_calls_are_capped(self):
+        deadline.start(2.0)
+        connect, read = deadline.optional(deadline.timeout, (3.05, 30))
+        self.assertTrue(read <= 2.0 - current_app.config['REQUEST_MIN_TIMEOUT'])
+        self.assertEqual(connect, read)
+        self.assertFalse(getattr(g, 'optional', False))
+
+    def test_slot_timeout(self):
+        deadline.start(None)
+        self.assertEqual(deadline.optional(deadline.slot_timeout), None)
+        deadline.start(2.0)
+        self.assertEqual(deadline.slot_timeout(), None)
+        self.assertTrue(deadline.optional(deadline.slot_timeout) <= 2.0 - current_app.config['REQUEST_MIN_TIMEOUT'])
+
+    def test_optional_stage_is_skipped_after_the_deadline(self):
+        deadline.start(current_app.config['REQUEST_MIN_TIMEOUT']/2)
+        skipped = self.counter('stages_skipped')
+        calls = []
+        self.assertEqual(deadline.optional(calls.append, 1), None)
+        self.assertEqual(calls, [])
+        self.assertEqual(self.counter('stages_skipped'), skipped + 1)
+
+    def test_optional_stage_that_times_out(self):
+        deadline.start(10.0)
+        timed_out = self.counter('stages_timed_out')
+        def slow():
+            raise ReadTimeout()
+        self.assertEqual(deadline.optional(slow), None)
+        self.assertEqual(self.counter('stages_timed_out'), timed_out + 1)
+        def fail():
+            raise ValueError()
+        self.assertRaises(ValueError, deadline.optional, fail)
+
+    def test_wait(self):
+        self.assertEqual(deadline.wait(None), None)
+        done = Future()
+        done.set_result(42)
+        deadline.start(10.0)
+        self.assertEqual(deadline.wait(done), 42)
+        deadline.start(current_app.config['REQUEST_MIN_TIMEOUT'] + 0.05)
+        started = time.time()
+        self.assertEqual(deadline.wait(Future()), None)
+        self.assertTrue(time.time() - started < 1.0)
+
+class TestPartialResults(AppTestCase):
+
+    def setUp(self):
+        self.solr = get_solr()
+        self.request_deadline = self.app.config['REQUEST_DEADLINE']
+
+    def tearDown(self):
+        self.solr.latency = 0.0
+        self.app.config['REQUEST_DEADLINE'] = self.request_deadline
+
+    def test_partial_results(self):
+        bibcode = bibcodes()[0]
+        complete = self.client.get('/%s' % bibcode).json
+        self.assertFalse(complete.get('partial'))
+        # the optional stages cannot finish in time when every Solr query takes 0.3s
+        self.solr.latency = 0.3
+        self.app.config['REQUEST_DEADLINE'] = self.app.config['REQUEST_MIN_TIMEOUT'] + 0.4
+        partial = current_app.metrics.report()['counters'].get('requests_partial', 0)
+        resp = self.client.get('/%s' % bibcode)
+        self.assert200(resp)
+        self.assertTrue(resp.json['partial'])
+        self.assertEqual(resp.json['paper'], bibcode)
+        self.assertEqual(current_app.metrics.report()['counters']['requests_partial'], partial + 1)
+        self.solr.latency = 0.0
+        self.assertEqual(self.client.get('/%s' % bibcode).json, complete)
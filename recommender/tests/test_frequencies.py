@@ -0,0 +1,35 @@
+import random
+import operator
+import unittest
+from itertools import groupby
+from collections import Counter
+from recommender.utils.recommender import get_frequencies
+
+def sorted_frequencies(l):
+    '''
+    The frequency distribution as it was computed before get_frequencies used a heap
+    '''
+    tmp = [(k,len(list(g))) for k, g in groupby(sorted(l))]
+    return sorted(tmp, key=operator.itemgetter(1),reverse=True)[:100]
+
+class TestFrequencies(unittest.TestCase):
+
+    def test_ties_in_alphabetical_order(self):
+        self.assertEqual(get_frequencies(['c', 'b', 'a', 'b', 'c', 'd']), [('b', 2), ('c', 2), ('a', 1), ('d', 1)])
+
+    def test_matches_sorted_frequencies(self):
+        rng = random.Random(42)
+        for n in (0, 1, 10, 500, 5000):
+            items = ['%04d' % rng.randint(0, n//3 + 1) for i in range(n)]
+            self.assertEqual(get_frequencies(items), sorted_frequencies(items))
+
+    def test_counter(self):
+        rng = random.Random(7)
+        items = ['p%s' % rng.randint(0, 300) for i in range(3000)]
+        self.assertEqual(get_frequencies(Counter(items)), sorted_frequencies(items))
+
+    def test_top_100(self):
+        self.assertEqual(len(get_frequencies(range(1000))), 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from recommender.tests.base import AppTestCase, bibcodes
+from recommender.utils.metrics import Histogram
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram(buckets=(0.01, 0.1, 1.0, float('inf')))
+        for value in [0.005]*90 + [0.05]*9 + [0.5]:
+            histogram.observe(value)
+        self.assertEqual((histogram.percentile(50), histogram.percentile(95), histogram.percentile(100)), (0.01, 0.1, 0.5))
+        report = histogram.report()
+        self.assertEqual(report['count'], 100)
+        self.assertEqual(report['buckets'], {'0.01': 90, '0.1': 9, '1': 1, 'inf': 0})
+
+    def test_empty(self):
+        self.assertEqual(Histogram().percentile(50), 0.0)
+
+class TestMetrics(AppTestCase):
+
+    def test_timing_header(self):
+        bibcode = bibcodes()[0]
+        self.assertFalse('X-Timing' in self.client.get('/%s' % bibcode).headers)
+        resp = self.client.get('/%s?timing=1' % bibcode)
+        self.assert200(resp)
+        timings = dict(item.split('=') for item in resp.headers['X-Timing'].split(', '))
+        for stage in ['request', 'find_paper_cluster', 'find_recommendations', 'get_article_data']:
+            self.assertTrue(stage in timings)
+        for value in timings.values():
+            self.assertTrue(float(value) >= 0)
+        self.assertTrue(float(timings['request']) >= float(timings['find_recommendations']))
+
+    def test_metrics(self):
+        before = self.client.get('/metrics').json
+        self.assert200(self.client.get('/%s' % bibcodes()[1]))
+        after = self.client.get('/metrics').json
+        self.assertEqual(after['stages']['request']['count'], before['stages'].get('request', {}).get('count', 0) + 1)
+        self.assertEqual(after['counters']['requests_miss'], before['counters'].get('requests_miss', 0) + 1)
+        self.assertTrue(after['counters']['solr_queries'] > before['counters'].get('solr_queries', 0))
+        for key in ['caches', 'precomputed', 'model']:
+            self.assertTrue(key in after)
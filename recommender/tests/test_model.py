@@ -0,0 +1,121 @@
+import os
+import time
+import shutil
+import threading
+import numpy as np
+from flask import current_app
+from recommender.tests.base import AppTestCase, data_path
+from recommender.utils.model import ModelManager
+from recommender.utils.database import db, Clustering, Clusters
+
+class TestModelManager(AppTestCase):
+
+    def setUp(self):
+        self.path = os.path.join(data_path(), 'model-test')
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        self.model = self.manager()
+
+    def manager(self, refresh=3600):
+        return ModelManager(current_app.model.projection_path, os.path.join(self.path, 'coordinates'),
+                            trees_path=os.path.join(self.path, 'trees'), min_tree_size=10, refresh=refresh,
+                            arena_path=os.path.join(self.path, 'arena'))
+
+    def test_load(self):
+        self.assertFalse(self.model.ready())
+        snapshot = self.model.current()
+        self.assertTrue(self.model.ready())
+        info = self.model.info()
+        self.assertEqual(info['version'], snapshot.version)
+        self.assertEqual(info['members'], len(snapshot.coordinates.current()['bibcodes']))
+        # the KD-trees are built along with the coordinate snapshot
+        self.assertTrue(snapshot.coordinates.current()['trees'])
+
+    def test_inconsistent_snapshot_is_not_swapped_in(self):
+        snapshot = self.model.load()
+        # coordinates of another clustering: one cluster less
+        coordinates = os.path.join(self.path, 'coordinates')
+        clusters = np.load(os.path.join(coordinates, 'clusters.npy'))
+        offsets = np.load(os.path.join(coordinates, 'offsets.npy'))
+        np.save(os.path.join(coordinates, 'clusters.npy'), clusters[:-1])
+        np.save(os.path.join(coordinates, 'offsets.npy'), offsets[:-1])
+        with open(os.path.join(coordinates, 'built'), 'w') as f:
+            f.write('%f\n' % time.time())
+        self.assertRaises(ValueError, self.model.load)
+        self.assertTrue(self.model.active is snapshot)
+        self.assertTrue('error' in self.model.info())
+        # a forced reload rebuilds the coordinates from the database
+        self.assertNotEqual(self.model.load(force=True).version, snapshot.version)
+        self.assertFalse('error' in self.model.info())
+
+    def test_members_are_compared(self):
+        snapshot = self.model.load()
+        # the same cluster sizes, but two papers swapped between clusters
+        coordinates = os.path.join(self.path, 'coordinates')
+        bibcodes = np.load(os.path.join(coordinates, 'bibcodes.npy'))
+        offsets = np.load(os.path.join(coordinates, 'offsets.npy'))
+        bibcodes[[offsets[0], offsets[1]]] = bibcodes[[offsets[1], offsets[0]]]
+        np.save(os.path.join(coordinates, 'bibcodes.npy'), bibcodes)
+        with open(os.path.join(coordinates, 'built'), 'w') as f:
+            f.write('%f\n' % time.time())
+        self.assertRaises(ValueError, self.model.load)
+        self.assertTrue(self.model.active is snapshot)
+
+    def test_rejected_snapshot_is_not_published(self):
+        snapshot = self.model.load()
+        # a new clustering of which only the coordinates are in the database yet
+        row = db.session.query(Clustering).first()
+        cluster = row.cluster
+        row.cluster = db.session.query(Clustering).filter(Clustering.cluster != cluster).first().cluster
+        db.session.commit()
+        try:
+            self.assertRaises(ValueError, self.model.load, force=True)
+            self.assertTrue(self.model.active is snapshot)
+            self.assertEqual(sorted(os.listdir(self.path)), ['arena', 'arena.lock', 'coordinates', 'coordinates.lock',
+                                                             'coordinates.model.lock', 'trees'])
+            # another process still loads the snapshot on disk, even when it is due for a rebuild
+            self.assertEqual(self.manager().current().version, snapshot.version)
+            model = self.manager(refresh=0)
+            self.assertEqual(model.current().version, snapshot.version)
+            self.assertTrue('error' in model.info())
+        finally:
+            row.cluster = cluster
+            db.session.commit()
+
+    def test_periodic_reload_after_a_new_clustering(self):
+        self.model = self.manager(refresh=0)
+        snapshot = self.model.load()
+        # a new clustering: one paper moved to another cluster
+        row = db.session.query(Clustering).first()
+        cluster = row.cluster
+        source = db.session.query(Clusters).filter(Clusters.cluster == cluster).first()
+        target = db.session.query(Clusters).filter(Clusters.cluster != cluster).first()
+        members = list(source.members), list(target.members)
+        row.cluster = target.cluster
+        source.members = [b for b in members[0] if b != row.bibcode]
+        target.members = members[1] + [row.bibcode]
+        db.session.commit()
+        try:
+            reloaded = self.model.load()
+            self.assertNotEqual(reloaded.version, snapshot.version)
+            self.assertEqual(reloaded.clusters.lookup(row.bibcode), target.cluster)
+            self.assertFalse('error' in self.model.info())
+        finally:
+            row.cluster = cluster
+            source.members, target.members = members
+            db.session.commit()
+
+    def test_ready_starts_a_load_without_a_loader(self):
+        model = current_app.model
+        current_app.model = self.model
+        try:
+            # the loader thread of a process that was forked while loading is gone in the child
+            self.model.loading = threading.Thread(target=lambda: None)
+            self.model.loading.start()
+            self.model.loading.join()
+            self.assertEqual(self.client.get('/ready').status_code, 503)
+            self.model.loading.join(30)
+            self.assert200(self.client.get('/ready'))
+        finally:
+            current_app.model = model
@@ -0,0 +1,72 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+from StringIO import StringIO
+from flask import current_app
+from recommender.tests.base import AppTestCase
+from recommender.utils.recommender import get_recommendations, get_model
+from recommender.utils.precompute import precompute_recommendations
+from recommender.utils.store import RecommendationStore, RecommendationWriter
+
+class TestRecommendationStore(AppTestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = RecommendationStore(os.path.join(self.path, 'recommendations.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, results):
+        writer = RecommendationWriter(self.store.path)
+        writer.add(results)
+        writer.close()
+
+    def test_no_lookup_table(self):
+        self.assertEqual(self.store.get('2011A'), None)
+        self.assertEqual(self.store.info(), {})
+
+    def test_lookup(self):
+        self.write([('2011A', {'paper': '2011A', 'recommendations': [1, 2]}), ('2011B', {'paper': '2011B'})])
+        self.assertEqual(self.store.get('2011A'), {'paper': '2011A', 'recommendations': [1, 2]})
+        self.assertEqual(self.store.get('2011C'), None)
+        self.assertEqual(self.store.info()['count'], 2)
+
+    def test_replaced_lookup_table(self):
+        self.write([('2011A', {'paper': '2011A'})])
+        self.assertEqual(self.store.get('2011A'), {'paper': '2011A'})
+        db = self.store.connection()
+        self.write([('2011B', {'paper': '2011B'})])
+        self.assertEqual(self.store.get('2011A'), None)
+        self.assertEqual(self.store.get('2011B'), {'paper': '2011B'})
+        # the connection to the replaced file is closed
+        self.assertRaises(sqlite3.ProgrammingError, db.execute, 'SELECT 1')
+
+class TestPrecompute(AppTestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.refresh = current_app.model.refresh
+        self.stderr, sys.stderr = sys.stderr, StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        current_app.model.refresh = self.refresh
+        shutil.rmtree(self.path)
+
+    def test_matches_single_requests(self):
+        path = os.path.join(self.path, 'recommendations.db')
+        n, failed = precompute_recommendations(path, processes=2, batch_size=50)
+        bibcodes = get_model().coordinates.current()['bibcodes']
+        self.assertEqual(n + failed, len(bibcodes))
+        store = RecommendationStore(path)
+        self.assertEqual(store.info()['count'], n)
+        checked = 0
+        for bibcode in bibcodes[::len(bibcodes)//20]:
+            result = store.get(bibcode)
+            if result is not None:
+                self.assertEqual(result, get_recommendations(bibcode))
+                checked += 1
+        self.assertTrue(checked > 10)
@@ -0,0 +1,60 @@
+from flask import current_app
+from recommender.tests.base import AppTestCase, bibcodes, get_solr
+from recommender.utils.cache import LRUCache
+from recommender.utils.recommender import solr_bulk_query, get_metadata
+
+class TestSolrBulkQuery(AppTestCase):
+
+    def setUp(self):
+        self.chunk_size = current_app.config['CHUNK_SIZE']
+        current_app.config['CHUNK_SIZE'] = 7
+
+    def tearDown(self):
+        current_app.config['CHUNK_SIZE'] = self.chunk_size
+
+    def test_chunks_are_merged(self):
+        solr = get_solr()
+        biblist = bibcodes()[:30]
+        queries = solr.queries
+        # 31 distinct bibcodes, in batches of 7
+        docs = solr_bulk_query(biblist + biblist[:5] + ['1999UNKNOWN'], 'bibcode,title')
+        self.assertEqual(solr.queries - queries, 5)
+        self.assertEqual(sorted(doc['bibcode'] for doc in docs), sorted(b for b in biblist if b in solr.docs))
+        for doc in docs:
+            self.assertTrue(set(doc) <= set(['bibcode', 'title']))
+
+    def test_single_chunk(self):
+        biblist = bibcodes()[:30]
+        chunked = solr_bulk_query(biblist, 'bibcode,title')
+        current_app.config['CHUNK_SIZE'] = 100
+        self.assertEqual(sorted(solr_bulk_query(biblist, 'bibcode,title')), sorted(chunked))
+
+    def test_no_bibcodes(self):
+        self.assertEqual(solr_bulk_query([], 'bibcode'), [])
+
+class TestMetadata(AppTestCase):
+
+    def setUp(self):
+        self.cache = current_app.metadata_cache
+        current_app.metadata_cache = LRUCache(maxsize=1000, ttl=60)
+
+    def tearDown(self):
+        current_app.metadata_cache = self.cache
+
+    def test_only_missing_bibcodes_are_queried(self):
+        solr = get_solr()
+        biblist = [b for b in bibcodes() if b in solr.docs][:20]
+        cached = {'bibcode': biblist[0], 'title': ['Cached']}
+        current_app.metadata_cache.set(biblist[0], cached)
+        queries = solr.queries
+        docs = get_metadata(biblist + ['1999UNKNOWN'])
+        self.assertEqual(solr.queries - queries, 1)
+        self.assertEqual(sorted(docs), sorted(biblist))
+        self.assertEqual(docs[biblist[0]], cached)
+        for bibcode in biblist[1:]:
+            self.assertEqual(docs[bibcode]['bibcode'], bibcode)
+            self.assertEqual(docs[bibcode].get('title'), solr.docs[bibcode].get('title'))
+        # all of them are cached now
+        queries = solr.queries
+        self.assertEqual(get_metadata(biblist), docs)
+        self.assertEqual(solr.queries, queries)
@@ -0,0 +1,74 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import sqlite3
+import numpy as np
+from recommender.utils.vectors import VectorCache
+
+class TestVectorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = VectorCache(os.path.join(self.path, 'vectors.db'), ttl=60, maxsize=100, projected=True)
+        self.indices = np.array([3, 7, 11], dtype=np.int32)
+        self.weights = np.array([0.5, 0.25, 0.25])
+        self.projection = np.arange(100, dtype=np.float64)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        self.cache.set('2011A', self.indices, self.weights, self.projection, version='v1')
+        indices, weights, projection = self.cache.get('2011A', version='v1')
+        np.testing.assert_array_equal(indices, self.indices)
+        np.testing.assert_array_equal(weights, self.weights)
+        np.testing.assert_array_equal(projection, self.projection)
+        self.assertEqual(self.cache.get('2011B', version='v1'), None)
+        self.assertEqual(sorted(self.cache.get_many(['2011A', '2011B'], version='v1')), ['2011A'])
+
+    def test_projection_of_another_model_version_is_ignored(self):
+        self.cache.set('2011A', self.indices, self.weights, self.projection, version='v1')
+        indices, weights, projection = self.cache.get('2011A', version='v2')
+        self.assertEqual(projection, None)
+        np.testing.assert_array_equal(weights, self.weights)
+        self.assertEqual(self.cache.get('2011A')[2], None)
+
+    def test_projections_not_stored_unless_projected(self):
+        cache = VectorCache(os.path.join(self.path, 'plain.db'), projected=False)
+        cache.set('2011A', self.indices, self.weights, self.projection, version='v1')
+        self.assertEqual(cache.get('2011A', version='v1')[2], None)
+
+    def test_expired_entries(self):
+        cache = VectorCache(os.path.join(self.path, 'expiring.db'), ttl=-1)
+        cache.set('2011A', self.indices, self.weights)
+        self.assertEqual(cache.get('2011A'), None)
+
+    def test_disabled(self):
+        cache = VectorCache(os.path.join(self.path, 'disabled.db'), maxsize=0)
+        cache.set('2011A', self.indices, self.weights)
+        self.assertEqual(cache.get('2011A'), None)
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'disabled.db')))
+
+    def test_prune(self):
+        cache = VectorCache(os.path.join(self.path, 'small.db'), maxsize=10)
+        cache.set_many([('%04d' % i, self.indices, self.weights, None) for i in range(25)])
+        cache.prune()
+        self.assertEqual(cache.stats()['entries'], 10)
+
+    def test_cache_without_versions(self):
+        path = os.path.join(self.path, 'old.db')
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE vectors (bibcode TEXT PRIMARY KEY, expires REAL, indices BLOB, weights BLOB, projection BLOB)')
+        db.execute('INSERT INTO vectors VALUES (?, ?, ?, ?, ?)', ('2011A', time.time() + 60, buffer(self.indices.tostring()),
+                   buffer(self.weights.tostring()), buffer(self.projection.tostring())))
+        db.commit()
+        db.close()
+        cache = VectorCache(path, projected=True)
+        self.assertEqual(cache.get('2011A', version='v1')[2], None)
+        cache.set('2011A', self.indices, self.weights, self.projection, version='v1')
+        np.testing.assert_array_equal(cache.get('2011A', version='v1')[2], self.projection)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import simplejson as json
+from recommender.tests.base import AppTestCase, bibcodes
+
+class TestBatch(AppTestCase):
+
+    def test_batch_matches_single_requests(self):
+        biblist = bibcodes()[:40] + ['1999UNKNOWN']
+        single = []
+        for bibcode in biblist:
+            resp = self.client.get('/%s' % bibcode)
+            single.append(resp.json if resp.status_code == 200 else None)
+        resp = self.client.post('/batch', data=json.dumps({'bibcodes': biblist}))
+        self.assert200(resp)
+        results = resp.json['results']
+        self.assertEqual([r['paper'] for r in results], biblist)
+        for bibcode, expected, result in zip(biblist, single, results):
+            if expected is None:
+                self.assertTrue('error' in result)
+            else:
+                self.assertEqual(result, expected)
+
+    def test_invalid_bibcodes(self):
+        for body in ['{"bibcodes": "abc"}', '{"bibcodes": [["a"]]}', '{"bibcodes": [1]}', '{"bibcodes": {"a": 1}}', '{}', 'abc']:
+            self.assert400(self.client.post('/batch', data=body))
+
+    def test_too_many_bibcodes(self):
+        biblist = ['1999UNKNOWN%s' % i for i in range(self.app.config['MAX_INPUT'] + 1)]
+        self.assert400(self.client.post('/batch', data=json.dumps({'bibcodes': biblist})))
@@ -0,0 +1,158 @@
+'''
+In-process caches
+'''
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import simplejson as json
+
+def approximate_size(value):
+    '''
+    Approximate memory footprint of a (JSON serializable) cache entry
+    '''
+    return len(json.dumps(value))
+
+class LRUCache(object):
+    '''
+    Thread-safe least-recently-used cache, with entries that expire 'ttl' seconds
+    after they were stored. It holds at most 'maxsize' entries and, if 'maxbytes'
+    is given, evicts the least recently used entries when the approximate size
+    of all entries exceeds it.
+    '''
+    def __init__(self, maxsize=10000, ttl=3600, maxbytes=None, sizeof=approximate_size):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _lookup(self, key, now):
+        entry = self.data.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] < now:
+            self.nbytes -= entry[1]
+            self.misses += 1
+            return None
+        # re-insert, to mark it as the most recently used entry
+        self.data[key] = entry
+        self.hits += 1
+        return entry
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self._lookup(key, time.time())
+        if entry is None:
+            return default
+        return entry[2]
+
+    def get_many(self, keys):
+        '''
+        Return a dictionary with the cached values for those keys that are in the cache
+        '''
+        found = {}
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                entry = self._lookup(key, now)
+                if entry is not None:
+                    found[key] = entry[2]
+        return found
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        size = self.sizeof(value) if self.maxbytes else 0
+        with self.lock:
+            old = self.data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.data[key] = (time.time() + ttl, size, value)
+            self.nbytes += size
+            while self.data and (len(self.data) > self.maxsize or
+                                 (self.maxbytes and self.nbytes > self.maxbytes)):
+                key, entry = self.data.popitem(last=False)
+                self.nbytes -= entry[1]
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.data.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        '''
+        Hit/miss statistics of the cache
+        '''
+        lookups = self.hits + self.misses
+        return {'entries': len(self.data), 'bytes': self.nbytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_ratio': float(self.hits)/lookups if lookups else 0.0}
+
+class ResultCache(object):
+    '''
+    Cache for computed results with single-flight coalescing: concurrent requests
+    for the same uncached key wait for one computation instead of each running it.
+    Results are kept in 'backend', which needs get(key) and set(key, value, ttl)
+    methods; by default this is an in-process LRUCache, but a store shared between
+    worker processes can be plugged in.
+    '''
+    HIT = 'HIT'
+    MISS = 'MISS'
+    COALESCED = 'COALESCED'
+
+    def __init__(self, backend=None, ttl=3600, maxsize=10000):
+        if backend is None:
+            backend = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.backend = backend
+        self.ttl = ttl
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, func, cacheable=None):
+        '''
+        Return the cached result for 'key', or compute it by calling 'func'. Returns
+        a (result, status) tuple, where the status tells whether the result was
+        a cache HIT, computed for this call (MISS) or computed for a concurrent
+        call (COALESCED). Results of failing computations are not cached, nor are
+        results for which the function 'cacheable' (if given) returns False.
+        '''
+        value = self.backend.get(key)
+        if value is not None:
+            return value, self.HIT
+        with self.lock:
+            call = self.inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self.inflight[key] = Future()
+        if not leader:
+            return call.result(), self.COALESCED
+        try:
+            value = func()
+        except Exception, e:
+            call.set_exception(e)
+            raise
+        else:
+            if cacheable is None or cacheable(value):
+                self.backend.set(key, value, self.ttl)
+            call.set_result(value)
+            return value, self.MISS
+        finally:
+            with self.lock:
+                del self.inflight[key]
@@ -0,0 +1,221 @@
+'''
+Index of the clusters: centroids and cluster membership, as flat arrays that can
+be shared by all worker processes
+'''
+import os
+import time
+import fcntl
+import shutil
+import threading
+import numpy as np
+from contextlib import contextmanager
+from database import db, Clusters
+
+ARENA_FILES = ('clusters', 'centroids', 'member_bibcodes', 'member_clusters')
+
+def encode(bibcodes):
+    '''
+    Return an array of bibcodes as (UTF-8 encoded) byte strings
+    '''
+    return np.array([b.encode('utf-8') if isinstance(b, unicode) else b for b in bibcodes], dtype=str)
+
+class ClusterIndex(object):
+    '''
+    Holds the centroids of all clusters as one (n_clusters, 100) array, together
+    with the cluster membership as two parallel arrays: the sorted bibcodes of all
+    members, and their clusters. The index is built from the 'clusters' table on
+    first use and rebuilt when it is older than 'refresh' seconds (never if
+    'refresh' is None).
+
+    If 'path' is given, the arrays are written to files in that directory (the
+    arena; on Linux, a directory in /dev/shm keeps them in memory) and memory-mapped
+    read-only, so that all worker processes share one copy. A process attaches to an
+    arena built by another one if it is recent enough, instead of building its own.
+    An arena built with load(stage=True) is written next to the shared one, and only
+    replaces it when publish() is called (e.g. once it has been checked).
+    '''
+    def __init__(self, refresh=3600, path=None):
+        self.refresh = refresh
+        self.path = path
+        self.built = None
+        self.state = None
+        self.staged = None
+        self.lock = threading.Lock()
+
+    def build(self, stage=False):
+        '''
+        Read all clusters from the database and swap in the new index. With 'stage',
+        the arena is written to a staging directory (see publish)
+        '''
+        rows = db.session.query(Clusters.cluster, Clusters.centroid, Clusters.members).all()
+        clusters = np.array([row.cluster for row in rows], dtype=np.int32)
+        centroids = np.array([row.centroid for row in rows], dtype=np.float64)
+        bibcodes = []
+        members = []
+        for row in rows:
+            bibcodes += row.members or []
+            members += [row.cluster]*len(row.members or [])
+        # A paper listed in more than one cluster belongs to the last one
+        bibcodes = encode(bibcodes[::-1])
+        bibcodes, first = np.unique(bibcodes, return_index=True)
+        members = np.array(members[::-1], dtype=np.int32)[first]
+        data = {'clusters': clusters, 'centroids': centroids, 'member_bibcodes': bibcodes, 'member_clusters': members}
+        if self.path:
+            path = '%s.new' % self.path if stage else self.path
+            self.write_arena(data, path)
+            self.staged = path if stage else None
+            return self.attach(path)
+        self.state = tuple(data[name] for name in ARENA_FILES)
+        self.built = time.time()
+        return self.state
+
+    def write_arena(self, data, path):
+        # Write to a temporary directory first and move it in place when complete;
+        # processes attached to the old arena keep their (memory-mapped) copy
+        tmp_path = '%s.tmp' % path
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        for name in ARENA_FILES:
+            np.save(os.path.join(tmp_path, '%s.npy' % name), data[name])
+        with open(os.path.join(tmp_path, 'built'), 'w') as f:
+            f.write('%f\n' % time.time())
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+    def arena_age(self):
+        '''
+        Return the number of seconds since the arena was built, or None if there is none
+        '''
+        try:
+            with open(os.path.join(self.path, 'built')) as f:
+                return time.time() - float(f.read())
+        except (IOError, ValueError):
+            return None
+
+    def attach(self, path=None):
+        '''
+        Memory-map the arrays of the arena (or of the arena in 'path')
+        '''
+        path = path or self.path
+        with open(os.path.join(path, 'built')) as f:
+            built = float(f.read())
+        self.state = tuple(np.load(os.path.join(path, '%s.npy' % name), mmap_mode='r') for name in ARENA_FILES)
+        self.built = built
+        return self.state
+
+    @contextmanager
+    def arena_lock(self):
+        '''
+        Hold the lock of the arena (across processes) while building, replacing or
+        attaching to it
+        '''
+        parent = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        with open('%s.lock' % self.path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self, max_age=None, stage=False):
+        '''
+        Attach to the arena if it is at most 'max_age' seconds old (any age if None),
+        or else build it. Without an arena, the index is always built. Processes
+        sharing the arena take turns, so that it is built by one process at a time.
+        With 'stage', a new arena is not shared until publish() is called; one
+        process at a time may stage an arena.
+        '''
+        if not self.path:
+            return self.build()
+        with self.arena_lock():
+            age = self.arena_age()
+            if age is not None and (max_age is None or age <= max_age):
+                return self.attach()
+            return self.build(stage=stage)
+
+    def publish(self):
+        '''
+        Replace the shared arena by the one staged by load(stage=True), if any
+        '''
+        if self.staged is None:
+            return
+        with self.arena_lock():
+            if os.path.exists(self.path):
+                shutil.rmtree(self.path)
+            os.rename(self.staged, self.path)
+        self.staged = None
+
+    def discard(self):
+        '''
+        Remove the arena staged by load(stage=True), if any, without sharing it
+        '''
+        if self.staged is not None:
+            shutil.rmtree(self.staged, True)
+            self.staged = None
+
+    def current(self):
+        '''
+        Return the current (clusters, centroids, member bibcodes, member clusters)
+        state, (re)building the index first if needed. While a stale index is being
+        rebuilt by one thread, other threads keep using the old one.
+        '''
+        if self.state is None:
+            with self.lock:
+                if self.state is None:
+                    self.load(max_age=self.refresh)
+        elif self.refresh is not None and time.time() - self.built > self.refresh and self.lock.acquire(False):
+            try:
+                self.load(max_age=self.refresh)
+            finally:
+                self.lock.release()
+        return self.state
+
+    def members(self, bibcodes):
+        '''
+        Return an array with the cluster of each bibcode, and a boolean array that is
+        True for the papers that are a cluster member
+        '''
+        clusters, centroids, member_bibcodes, member_clusters = self.current()
+        assigned = np.empty(len(bibcodes), dtype=np.int32)
+        assigned.fill(-1)
+        found = np.zeros(len(bibcodes), dtype=bool)
+        if len(member_bibcodes) and len(bibcodes):
+            bibcodes = encode(bibcodes)
+            idx = np.minimum(np.searchsorted(member_bibcodes, bibcodes), len(member_bibcodes) - 1)
+            found = member_bibcodes[idx] == bibcodes
+            assigned[found] = member_clusters[idx[found]]
+        return assigned, found
+
+    def lookup(self, bibcode):
+        '''
+        Return the cluster a paper is a member of, or None
+        '''
+        assigned, found = self.members([bibcode])
+        return int(assigned[0]) if found[0] else None
+
+    def nearest(self, pvec):
+        '''
+        Return the cluster with the centroid closest to the given 100-dimensional vector
+        '''
+        clusters, centroids = self.current()[:2]
+        dist = np.sum((centroids - np.asarray(pvec))**2, axis=1)
+        return int(clusters[np.argmin(dist)])
+
+    def assign(self, bibcodes, pvecs):
+        '''
+        Batch version of lookup/nearest: return an array with the cluster for each
+        bibcode, using its row in the (n, 100) array 'pvecs' for papers that are not
+        a cluster member
+        '''
+        clusters, centroids = self.current()[:2]
+        assigned, found = self.members(bibcodes)
+        missing = ~found
+        if missing.any():
+            # |p - c|^2 = |p|^2 - 2p.c + |c|^2, where |p|^2 does not affect the closest centroid
+            dist = np.sum(centroids**2, axis=1) - 2*np.dot(np.asarray(pvecs)[missing], centroids.T)
+            assigned[missing] = clusters[np.argmin(dist, axis=1)]
+        return assigned
@@ -0,0 +1,212 @@
+'''
+Snapshot of the low-dimensional coordinates of all clustered papers
+'''
+import os
+import time
+import fcntl
+import shutil
+import threading
+import numpy as np
+from contextlib import contextmanager
+from database import db, Clustering
+from trees import snapshot_version, build_trees, load_trees
+from clusters import encode
+
+SNAPSHOT_FILES = ('bibcodes', 'coordinates', 'clusters', 'offsets')
+# Maximum size of the blocks of the distance matrix computed by nearest_many()
+MAX_BLOCK_SIZE = 4*1024*1024
+
+def build_snapshot(path, batch_size=10000):
+    '''
+    Write the 'vector_low' coordinates from the 'clustering' table to a snapshot
+    in the directory 'path'. Papers are grouped by cluster: the members of the
+    cluster clusters[i] are the rows offsets[i]:offsets[i+1] of the (contiguous,
+    float32) coordinates array and of the parallel bibcodes array
+    '''
+    bibcodes = []
+    coordinates = []
+    clusters = []
+    offsets = []
+    rows = db.session.query(Clustering.bibcode, Clustering.cluster, Clustering.vector_low).\
+        order_by(Clustering.cluster, Clustering.id).yield_per(batch_size)
+    for row in rows:
+        if not clusters or clusters[-1] != row.cluster:
+            clusters.append(row.cluster)
+            offsets.append(len(bibcodes))
+        bibcodes.append(row.bibcode)
+        coordinates.append(row.vector_low)
+    offsets.append(len(bibcodes))
+    data = {
+        'bibcodes': encode(bibcodes),
+        'coordinates': np.array(coordinates, dtype=np.float32),
+        'clusters': np.array(clusters, dtype=np.int32),
+        'offsets': np.array(offsets, dtype=np.int64),
+    }
+    # Write to a temporary directory first and move it in place when complete,
+    # so that a running service never picks up a partial snapshot
+    tmp_path = '%s.tmp' % path
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name in SNAPSHOT_FILES:
+        np.save(os.path.join(tmp_path, '%s.npy' % name), data[name])
+    with open(os.path.join(tmp_path, 'built'), 'w') as f:
+        f.write('%f\n' % time.time())
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return len(bibcodes)
+
+@contextmanager
+def snapshot_lock(path):
+    '''
+    Hold the lock of the snapshot in 'path' (across processes) while building,
+    replacing or loading it
+    '''
+    parent = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    with open('%s.lock' % path, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+class CoordinateSnapshot(object):
+    '''
+    Per-cluster low-dimensional coordinates, loaded (memory-mapped) from a snapshot
+    written by build_snapshot(). If no snapshot exists yet, it is built from the
+    database (along with the KD-trees) on first use. Clusters with at least 'min_tree_size' members, for which
+    a KD-tree has been built (see trees.build_trees) in 'trees_path', are searched
+    with the tree; the other clusters by brute force.
+    '''
+    def __init__(self, path, trees_path=None, min_tree_size=0):
+        self.path = path
+        self.trees_path = trees_path
+        self.min_tree_size = min_tree_size
+        self.state = None
+        self.staged = None
+        self.lock = threading.Lock()
+
+    def load(self, max_age=None, stage=False):
+        '''
+        (Re)load the snapshot from disk. It is built first if there is none, or if it
+        is more than 'max_age' seconds old; the KD-trees are then rebuilt along with
+        it. Processes take turns, so that the snapshot is built by one process at a
+        time and never loaded while another process replaces it. With 'stage', a new
+        snapshot (and its KD-trees) is written next to the current one, which it only
+        replaces when publish() is called; one process at a time may stage a snapshot.
+        '''
+        with snapshot_lock(self.path):
+            version = snapshot_version(self.path)
+            rebuild = version is None or (max_age is not None and time.time() - float(version) > max_age)
+            path, trees_path = self.path, self.trees_path
+            if rebuild and stage:
+                path = '%s.new' % self.path
+                trees_path = self.trees_path and '%s.new' % self.trees_path
+            if rebuild:
+                build_snapshot(path)
+            data = dict((name, np.load(os.path.join(path, '%s.npy' % name), mmap_mode='r'))
+                        for name in SNAPSHOT_FILES)
+            data['version'] = snapshot_version(path)
+            if rebuild and trees_path:
+                build_trees(data, data['version'], trees_path, self.min_tree_size)
+            data['trees'] = load_trees(trees_path, data, data['version'], self.min_tree_size)
+        self.staged = (path, trees_path) if rebuild and stage else None
+        self.state = data
+        return data
+
+    def publish(self):
+        '''
+        Replace the snapshot and KD-trees on disk by the ones staged by load(stage=True), if any
+        '''
+        if self.staged is None:
+            return
+        with snapshot_lock(self.path):
+            for staged, path in zip(self.staged, (self.path, self.trees_path)):
+                if staged is None:
+                    continue
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+                os.rename(staged, path)
+        self.staged = None
+
+    def discard(self):
+        '''
+        Remove the snapshot and KD-trees staged by load(stage=True), if any
+        '''
+        if self.staged is not None:
+            for staged in self.staged:
+                if staged is not None:
+                    shutil.rmtree(staged, True)
+            self.staged = None
+
+    def current(self):
+        if self.state is None:
+            with self.lock:
+                if self.state is None:
+                    self.load()
+        return self.state
+
+    def members(self, pcluster):
+        '''
+        Return the bibcodes and coordinates of the members of a cluster
+        '''
+        return self._members(self.current(), pcluster)
+
+    def _members(self, data, pcluster):
+        i = np.searchsorted(data['clusters'], int(pcluster))
+        if i == len(data['clusters']) or data['clusters'][i] != int(pcluster):
+            return data['bibcodes'][:0], data['coordinates'][:0]
+        start, end = data['offsets'][i], data['offsets'][i+1]
+        return data['bibcodes'][start:end], data['coordinates'][start:end]
+
+    def nearest(self, pcluster, vec, k):
+        '''
+        Return the bibcodes of the k members of a cluster closest to the given
+        vector, closest first
+        '''
+        data = self.current()
+        bibcodes, coordinates = self._members(data, pcluster)
+        tree = data['trees'].get(int(pcluster))
+        if tree is not None:
+            idx = tree.query(np.asarray(vec, dtype=np.float32), k=min(k, tree.n))[1]
+            return bibcodes[np.atleast_1d(idx)].tolist()
+        dist = np.sum((coordinates - np.asarray(vec, dtype=np.float32))**2, axis=1)
+        if k < len(dist):
+            idx = np.argpartition(dist, k)[:k]
+        else:
+            idx = np.arange(len(dist))
+        idx = idx[np.argsort(dist[idx], kind='mergesort')]
+        return bibcodes[idx].tolist()
+
+    def nearest_many(self, pcluster, vecs, k):
+        '''
+        Batch version of nearest(): for each row of 'vecs', return the bibcodes of the
+        k members of the cluster closest to it. The distances are computed for blocks
+        of rows at a time, to bound the memory used for large clusters.
+        '''
+        data = self.current()
+        bibcodes, coordinates = self._members(data, pcluster)
+        vecs = np.asarray(vecs, dtype=np.float32)
+        if len(bibcodes) == 0:
+            return [[] for vec in vecs]
+        tree = data['trees'].get(int(pcluster))
+        if tree is not None:
+            idx = tree.query(vecs, k=min(k, tree.n))[1].reshape(len(vecs), -1)
+            return [bibcodes[row_idx].tolist() for row_idx in idx]
+        # |v - c|^2 = |v|^2 - 2v.c + |c|^2, where |v|^2 does not affect the order per row
+        sq_norms = np.sum(coordinates**2, axis=1)
+        block = max(1, MAX_BLOCK_SIZE // len(bibcodes))
+        neighbours = []
+        for start in range(0, len(vecs), block):
+            dist = sq_norms - 2*np.dot(vecs[start:start+block], coordinates.T)
+            if k < dist.shape[1]:
+                idx = np.argpartition(dist, k, axis=1)[:, :k]
+            else:
+                idx = np.tile(np.arange(dist.shape[1]), (len(dist), 1))
+            for row, row_idx in zip(dist, idx):
+                row_idx = row_idx[np.argsort(row[row_idx], kind='mergesort')]
+                neighbours.append(bibcodes[row_idx].tolist())
+        return neighbours
@@ -0,0 +1,170 @@
+'''
+Compact binary store of the coreads, with interned bibcodes
+'''
+import os
+import shutil
+import time
+import threading
+import numpy as np
+from database import db, CoReads
+from clusters import encode
+
+COREADS_KEYS = ('before', 'after')
+COREADS_FILES = ('bibcodes',) + tuple('%s_%s' % (key, name) for key in COREADS_KEYS for name in ('offsets', 'ids', 'counts'))
+
+def build_coreads(path, batch_size=10000):
+    '''
+    Write the 'coreads' table to a store in the directory 'path'. All bibcodes (the
+    papers and the papers read before and after them) are interned: the id of a
+    bibcode is its position in the sorted bibcodes array, so that ordering by id is
+    ordering by bibcode. The coreads read before (after) the paper with id i are the
+    entries before_offsets[i]:before_offsets[i+1] of the parallel before_ids and
+    before_counts arrays.
+    '''
+    def rows():
+        return db.session.query(CoReads.bibcode, CoReads.coreads).yield_per(batch_size)
+    # First pass: collect all bibcodes
+    bibcodes = set()
+    for row in rows():
+        bibcodes.add(row.bibcode)
+        for key in COREADS_KEYS:
+            bibcodes.update(bibcode for bibcode, freq in row.coreads.get(key, []))
+    bibcodes = sorted(bibcodes)
+    index = dict((bibcode, i) for i, bibcode in enumerate(bibcodes))
+    # (UTF-8 encoding keeps the sort order, so the ids in index stay valid)
+    bibcodes = encode(bibcodes)
+    # Second pass: the coreads of every paper as ids, in table order. A paper
+    # that occurs more than once keeps its first row (like get_coreads)
+    seen = set()
+    parts = dict((key, ([], [], [])) for key in COREADS_KEYS)
+    for row in rows():
+        paper = index[row.bibcode]
+        if paper in seen:
+            continue
+        seen.add(paper)
+        for key in COREADS_KEYS:
+            entries = row.coreads.get(key, [])
+            papers, ids, counts = parts[key]
+            papers.append(np.repeat(np.int32(paper), len(entries)))
+            ids.append(np.array([index[bibcode] for bibcode, freq in entries], dtype=np.int32))
+            counts.append(np.array([freq for bibcode, freq in entries], dtype=np.int32))
+    data = {'bibcodes': bibcodes}
+    for key in COREADS_KEYS:
+        papers, ids, counts = [np.concatenate(part) if part else np.zeros(0, dtype=np.int32) for part in parts[key]]
+        # Order the entries by paper (keeping the order within a paper)
+        order = np.argsort(papers, kind='mergesort')
+        data['%s_offsets' % key] = np.concatenate(([0], np.cumsum(np.bincount(papers, minlength=len(bibcodes))))).astype(np.int64)
+        data['%s_ids' % key] = ids[order]
+        data['%s_counts' % key] = counts[order]
+    # Write to a temporary directory first and move it in place when complete,
+    # so that a running service never picks up a partial store
+    tmp_path = '%s.tmp' % path
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name in COREADS_FILES:
+        np.save(os.path.join(tmp_path, '%s.npy' % name), data[name])
+    with open(os.path.join(tmp_path, 'built'), 'w') as f:
+        f.write('%f\n' % time.time())
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return len(seen)
+
+def top_frequencies(bibcodes, ids, freqs, n=100):
+    '''
+    Given ids and their frequencies, return the n most frequent as (bibcode, frequency)
+    tuples, ties in order of id (i.e. alphabetical order, like get_frequencies)
+    '''
+    top = np.argsort(-freqs, kind='mergesort')[:n]
+    return zip(bibcodes[ids[top]].tolist(), freqs[top].tolist())
+
+class CoreadsStore(object):
+    '''
+    The coreads, loaded (memory-mapped) from a store written by build_coreads(). If
+    there is no store, available() is False and the coreads are taken from the database.
+    When the store is rebuilt, the new one is loaded on next use.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.state = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def stamp(self):
+        '''
+        Return the (inode, modification time) of the 'built' file of the store, which
+        changes with every build, or None if there is no store
+        '''
+        try:
+            stat = os.stat(os.path.join(self.path, 'built'))
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime)
+
+    def load(self, version=None):
+        '''
+        (Re)load the store from disk
+        '''
+        data = dict((name, np.load(os.path.join(self.path, '%s.npy' % name), mmap_mode='r'))
+                    for name in COREADS_FILES)
+        self.state = data
+        self.version = version or self.stamp()
+        return data
+
+    def current(self):
+        '''
+        Return the store, (re)loading it first if it was (re)built since it was loaded.
+        While a new store is being moved in place, the old one is used.
+        '''
+        version = self.stamp()
+        if version is not None and version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.load(version)
+        return self.state
+
+    def available(self):
+        return self.current() is not None
+
+    def gather(self, data, key, papers):
+        '''
+        Return the ids and counts of the coreads of 'key' of all papers (ids) together
+        '''
+        offsets = data['%s_offsets' % key]
+        starts, ends = offsets[papers], offsets[papers + 1]
+        lengths = ends - starts
+        # positions starts[i]:ends[i] for all papers, as one index array
+        idx = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return data['%s_ids' % key][idx], data['%s_counts' % key][idx]
+
+    def aggregate(self, G, remove=None):
+        '''
+        Vectorized version of aggregate_coreads: given a set of papers, return the
+        frequency distributions of the papers read just before, just after and together
+        with them (the top 100 of each, as lists of (bibcode, frequency) tuples)
+        '''
+        data = self.current()
+        bibcodes = data['bibcodes']
+        G = encode(G)
+        papers = np.searchsorted(bibcodes, G)
+        found = papers < len(bibcodes)
+        found[found] = bibcodes[papers[found]] == G[found]
+        papers = papers[found]
+        frequencies = []
+        also = []
+        for key in COREADS_KEYS:
+            ids, counts = self.gather(data, key, papers)
+            unique, inverse = np.unique(ids, return_inverse=True)
+            freqs = np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
+            frequencies.append(top_frequencies(bibcodes, unique, freqs))
+            also.append(ids)
+        # every paper read before or after one of the papers counts once for the alsoreads
+        unique, freqs = np.unique(np.concatenate(also), return_counts=True)
+        if remove:
+            remove = encode([remove])[0]
+            i = np.searchsorted(bibcodes, remove)
+            keep = unique != i if i < len(bibcodes) and bibcodes[i] == remove else slice(None)
+            unique, freqs = unique[keep], freqs[keep]
+        frequencies.append(top_frequencies(bibcodes, unique, freqs))
+        return tuple(frequencies)
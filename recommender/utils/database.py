@@ -1,5 +1,6 @@
 import simplejson as json
-from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, Text
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.dialects import postgresql
 from flask.ext.sqlalchemy import SQLAlchemy
@@ -23,23 +24,40 @@ class AlchemyEncoder(json.JSONEncoder):
 
         return json.JSONEncoder.default(self, obj)
 
+class JSONEncoded(TypeDecorator):
+    '''
+    Stores arrays and JSON documents as text, on databases without native
+    support for them (i.e. the SQLite databases used for benchmarking)
+    '''
+    impl = Text
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            value = json.dumps(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            value = json.loads(value)
+        return value
+
 class CoReads(db.Model):
     __tablename__='coreads'
     id = Column(Integer,primary_key=True)
     bibcode = Column(String,nullable=False,index=True)
-    coreads = Column(postgresql.JSON)
+    coreads = Column(postgresql.JSON().with_variant(JSONEncoded, 'sqlite'))
 
 class Clustering(db.Model):
     __tablename__='clustering'
     id = Column(Integer,primary_key=True)
     bibcode = Column(String,nullable=False,index=True)
     cluster = Column(Integer)
-    vector  = Column(postgresql.ARRAY(Float))
-    vector_low = Column(postgresql.ARRAY(Float))
+    vector  = Column(postgresql.ARRAY(Float).with_variant(JSONEncoded, 'sqlite'))
+    vector_low = Column(postgresql.ARRAY(Float).with_variant(JSONEncoded, 'sqlite'))
 
 class Clusters(db.Model):
     __tablename__='clusters'
     id = Column(Integer,primary_key=True)
     cluster = Column(Integer,index=True)
-    members  = Column(postgresql.ARRAY(String))
-    centroid = Column(postgresql.ARRAY(Float))
+    members  = Column(postgresql.ARRAY(String).with_variant(JSONEncoded, 'sqlite'))
+    centroid = Column(postgresql.ARRAY(Float).with_variant(JSONEncoded, 'sqlite'))
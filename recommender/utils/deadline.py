@@ -0,0 +1,92 @@
+'''
+Latency budget of a request: the deadline, the timeouts derived from it and the
+optional stages of the pipeline that are skipped when it is exceeded
+'''
+import time
+from requests.exceptions import Timeout
+from concurrent.futures import TimeoutError
+from flask import current_app, g
+from metrics import count
+
+def start(seconds):
+    '''
+    Set the deadline of the current request to 'seconds' from now (no deadline if None)
+    '''
+    g.deadline = time.time() + seconds if seconds else None
+
+def remaining():
+    '''
+    Return the number of seconds left until the deadline, or None if there is no deadline
+    '''
+    deadline = getattr(g, 'deadline', None)
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+def timeout(default):
+    '''
+    Cap the (connect, read) timeout of a call in an optional stage at the time left
+    until the deadline of the stage. Calls that are needed for any result keep the
+    default timeout: a slow result is better than none.
+    '''
+    left = remaining()
+    if left is None or not getattr(g, 'optional', False):
+        return default
+    left = max(left, 0.001)
+    connect, read = default
+    return (min(connect, left), min(read, left))
+
+def slot_timeout():
+    '''
+    Return the number of seconds a call in an optional stage may wait for a free Solr
+    query slot: the time left until the deadline of the stage. Calls that are needed
+    for any result wait as long as it takes (None).
+    '''
+    left = remaining()
+    if left is None or not getattr(g, 'optional', False):
+        return None
+    return max(left, 0.001)
+
+def optional(func, *args, **kwargs):
+    '''
+    Run an optional stage of the pipeline. It has to finish REQUEST_MIN_TIMEOUT seconds
+    before the deadline, which are kept for the calls needed for any result. Returns
+    None instead of its result if it cannot start in time, or if one of its calls
+    times out (or cannot get a Solr query slot in time).
+    '''
+    request_deadline = getattr(g, 'deadline', None)
+    if request_deadline is None:
+        return func(*args, **kwargs)
+    g.deadline = request_deadline - current_app.config['REQUEST_MIN_TIMEOUT']
+    g.optional = True
+    try:
+        if expired():
+            count('stages_skipped')
+            return None
+        return func(*args, **kwargs)
+    except Timeout:
+        count('stages_timed_out')
+        return None
+    finally:
+        g.deadline = request_deadline
+        g.optional = False
+
+def wait(future):
+    '''
+    Return the result of an optional stage that runs in the background (see
+    recommender.submit), or None if it is not done in time
+    '''
+    if future is None:
+        return None
+    left = remaining()
+    if left is not None:
+        left = max(left - current_app.config['REQUEST_MIN_TIMEOUT'], 0)
+    try:
+        return future.result(timeout=left)
+    except TimeoutError:
+        count('stages_timed_out')
+        return None
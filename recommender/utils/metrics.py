@@ -0,0 +1,112 @@
+'''
+Latency histograms and counters for the stages of the recommendation pipeline
+'''
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+class Histogram(object):
+    '''
+    Latency histogram with fixed buckets
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        '''
+        Estimate a percentile as the upper bound of the bucket it falls in
+        '''
+        if not self.count:
+            return 0.0
+        rank = q/100.0*self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def report(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'mean': self.sum/self.count if self.count else 0.0,
+                'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99),
+                'buckets': dict(('%g' % bound, count) for bound, count in zip(self.buckets, self.counts))}
+
+class Metrics(object):
+    '''
+    Thread-safe registry of latency histograms (per stage) and counters
+    '''
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def report(self):
+        with self.lock:
+            return {'uptime': time.time() - self.started,
+                    'stages': dict((name, h.report()) for name, h in self.histograms.items()),
+                    'counters': dict(self.counters)}
+
+@contextmanager
+def timed(stage):
+    '''
+    Record how long the enclosed block takes, in the histogram for 'stage' and in
+    the timing breakdown of the current request (g.timings), if there is one
+    '''
+    started = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - started
+        current_app.metrics.observe(stage, elapsed)
+        timings = getattr(g, 'timings', None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def count(name, value=1):
+    '''
+    Increment a counter of the current application
+    '''
+    current_app.metrics.increment(name, value)
+
+def record_solr_response(resp, docs):
+    count('solr_queries')
+    count('solr_docs', docs)
+    count('solr_bytes_received', len(resp.content))
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    if not has_app_context() or not hasattr(current_app, 'metrics'):
+        return
+    count('db_queries')
+    if cursor.rowcount > 0:
+        count('db_rows', cursor.rowcount)
@@ -0,0 +1,194 @@
+'''
+Versioned snapshots of the cluster model, swapped in without a restart
+'''
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+from projections import ProjectionRegistry
+from clusters import ClusterIndex
+from coordinates import CoordinateSnapshot, snapshot_lock
+
+class ModelSnapshot(object):
+    '''
+    One consistent version of the cluster model: the projection matrices, the
+    centroids and membership of the clusters, and the low-dimensional coordinates
+    of their members. Everything is loaded when the snapshot is created, and a
+    snapshot is never changed afterwards: a new version is a new snapshot.
+
+    The arrays are memory-mapped read-only, so that worker processes share them: the
+    clusters are taken from the arena in 'arena_path' if it is at most 'max_age'
+    seconds old, or else read from the database and written to the arena. The
+    coordinates are rebuilt from the database whenever the clusters are, and when
+    they are more than 'max_age' seconds old. With 'rebuild', both the clusters and
+    the coordinates (and KD-trees) are read from the database again. A snapshot of which the clusters do not match the
+    coordinates (e.g. after a new clustering, when only one of them has been
+    rebuilt) cannot be created, and what was rebuilt for it is thrown away.
+    '''
+    def __init__(self, projection_path, coordinates_path, trees_path=None, min_tree_size=0, arena_path=None,
+                 max_age=None, rebuild=False):
+        self.projections = ProjectionRegistry(projection_path)
+        # the index is not rebuilt by itself: a new version of the clusters comes with a new snapshot
+        self.clusters = ClusterIndex(refresh=None, path=arena_path)
+        self.coordinates = CoordinateSnapshot(coordinates_path, trees_path=trees_path, min_tree_size=min_tree_size)
+        # Processes take turns: what is rebuilt is staged, and only replaces the arena
+        # and coordinates on disk (for other processes to attach to) once it is checked
+        with snapshot_lock('%s.model' % coordinates_path):
+            try:
+                self.clusters.load(max_age=0 if rebuild else max_age, stage=True)
+                # the coordinates are rebuilt along with the clusters, so that both are of the same clustering
+                rebuild = rebuild or self.clusters.staged is not None
+                self.coordinates.load(max_age=0 if rebuild else max_age, stage=True)
+                self.check()
+            except Exception:
+                self.clusters.discard()
+                self.coordinates.discard()
+                raise
+            self.clusters.publish()
+            self.coordinates.publish()
+        self.loaded = time.time()
+        self.version = self.make_version()
+
+    def check(self):
+        '''
+        Make sure that the clusters and the coordinate snapshot are of the same
+        clustering: the same clusters, with the same members
+        '''
+        clusters, centroids, member_bibcodes, member_clusters = self.clusters.current()
+        data = self.coordinates.current()
+        ids = np.unique(member_clusters)
+        # the (cluster, bibcode) pairs of both, ordered by cluster and bibcode
+        order = np.lexsort((member_bibcodes, member_clusters))
+        coordinate_clusters = np.repeat(data['clusters'], np.diff(data['offsets']))
+        coordinate_order = np.lexsort((data['bibcodes'], coordinate_clusters))
+        if not (np.array_equal(member_clusters[order], coordinate_clusters[coordinate_order]) and
+                np.array_equal(member_bibcodes[order], data['bibcodes'][coordinate_order])):
+            raise ValueError('The clusters (%s clusters, %s members) do not match the coordinate snapshot %s '
+                             '(%s clusters, %s members); POST /model rebuilds both from the database' %
+                             (len(ids), len(member_bibcodes), data['version'], len(data['clusters']), len(data['bibcodes'])))
+
+    def make_version(self):
+        '''
+        Identify the version of the model by a digest of its sources: the projection
+        matrix files, the clusters and the coordinate snapshot
+        '''
+        digest = hashlib.sha1()
+        for pcluster, matrix in sorted(self.projections.matrices.items()):
+            stat = os.stat(matrix.filename)
+            digest.update('%s:%s:%s;' % (pcluster, stat.st_size, stat.st_mtime))
+        clusters, centroids, member_bibcodes, member_clusters = self.clusters.current()
+        digest.update(clusters.tostring())
+        digest.update(centroids.tostring())
+        digest.update('%s;%s' % (len(member_bibcodes), self.coordinates.current()['version']))
+        return digest.hexdigest()[:12]
+
+    def info(self):
+        clusters, centroids, member_bibcodes, member_clusters = self.clusters.current()
+        return {'version': self.version, 'loaded': self.loaded, 'projections': len(self.projections),
+                'clusters': len(clusters), 'members': len(member_bibcodes),
+                'coordinates': self.coordinates.current()['version']}
+
+class ModelManager(object):
+    '''
+    Holds the active model snapshot. A new snapshot is loaded in the background
+    while requests keep using the active one, and then swapped in as a whole
+    (double buffering); requests pin the snapshot they started with (see
+    recommender.get_model). The active snapshot is reloaded when it is older than
+    'refresh' seconds, or when reload() is called. Until the first snapshot has
+    been loaded, the service is not ready: current() then loads it, unless a
+    background load is already under way, which it waits for.
+
+    Worker processes share the clusters through the arena in 'arena_path': a snapshot
+    attaches to an arena that is at most 'refresh' seconds old (built by another
+    worker, or before the workers were forked), and only rebuilds it otherwise.
+    '''
+    def __init__(self, projection_path, coordinates_path, trees_path=None, min_tree_size=0, refresh=3600, arena_path=None):
+        self.projection_path = projection_path
+        self.coordinates_path = coordinates_path
+        self.trees_path = trees_path
+        self.min_tree_size = min_tree_size
+        self.arena_path = arena_path
+        self.refresh = refresh
+        self.active = None
+        self.error = None
+        self.loading = None
+        self.lock = threading.Lock()
+
+    def load(self, force=False):
+        '''
+        Load a new snapshot and make it the active one. With 'force', the clusters
+        and coordinates are rebuilt from the database even if they are recent. If
+        the new snapshot cannot be loaded (or is inconsistent), the active one is kept
+        and the error is reported by info(). Without an active snapshot, the clusters
+        and coordinates on disk (the last ones that were checked) are then used,
+        however old they are.
+        '''
+        try:
+            snapshot = self.snapshot(max_age=self.refresh, rebuild=force)
+        except Exception, e:
+            self.error = '%s: %s' % (e.__class__.__name__, e)
+            if self.active is not None:
+                raise
+            self.active = self.snapshot(max_age=None)
+            return self.active
+        self.active = snapshot
+        self.error = None
+        return snapshot
+
+    def snapshot(self, max_age=None, rebuild=False):
+        return ModelSnapshot(self.projection_path, self.coordinates_path,
+                             trees_path=self.trees_path, min_tree_size=self.min_tree_size,
+                             arena_path=self.arena_path, max_age=max_age, rebuild=rebuild)
+
+    def reload(self, app, force=False):
+        '''
+        Load a new snapshot in a background thread (within an application context
+        of 'app'), unless one is being loaded already. Returns the thread.
+        '''
+        with self.lock:
+            if self.loading is not None and self.loading.is_alive():
+                return self.loading
+            def run():
+                with app.app_context():
+                    try:
+                        self.load(force=force)
+                    except Exception:
+                        app.logger.exception('Loading a new model snapshot failed')
+            self.loading = threading.Thread(target=run, name='model-reload')
+            self.loading.daemon = True
+            self.loading.start()
+            return self.loading
+
+    def current(self, app=None):
+        '''
+        Return the active snapshot, loading the first one if needed. When the active
+        snapshot is older than 'refresh' seconds (and 'app' is given), a new one is
+        loaded in the background.
+        '''
+        snapshot = self.active
+        if snapshot is None:
+            loading = self.loading
+            if loading is not None and loading.is_alive():
+                loading.join()
+            with self.lock:
+                if self.active is None:
+                    self.load()
+            snapshot = self.active
+        elif app is not None and self.refresh is not None and time.time() - snapshot.loaded > self.refresh:
+            self.reload(app)
+        return snapshot
+
+    def ready(self):
+        return self.active is not None
+
+    def info(self):
+        '''
+        The version of the active snapshot, and whether a new one is being loaded
+        '''
+        info = self.active.info() if self.active is not None else {'version': None}
+        info['ready'] = self.ready()
+        info['loading'] = self.loading is not None and self.loading.is_alive()
+        if self.error:
+            info['error'] = self.error
+        return info
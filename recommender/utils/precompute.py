@@ -0,0 +1,85 @@
+'''
+Offline computation of the recommendations for all clustered papers
+'''
+import sys
+import time
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from database import db
+from recommender import find_batch_recommendations, get_model
+from store import RecommendationWriter
+
+def init_worker(app):
+    '''
+    Set up a worker process: it runs in the context of the (forked) application
+    and opens its own database and Solr connections. It uses the model snapshot
+    loaded before the fork, of which the coordinates are memory-mapped, so that
+    they are shared with all other processes.
+
+    The threads of the application's thread pools are not forked along with it, so
+    a forked pool whose threads were started already (e.g. by Solr queries made
+    before the fork) never runs anything: the worker gets new pools, a new Solr
+    session and new (thread-local) SQLite connections.
+    '''
+    app.client = app.client.__class__(app.config['CLIENT'])
+    app.executor = ThreadPoolExecutor(max_workers=app.config['EXECUTOR_WORKERS'])
+    app.vector_cache.local = threading.local()
+    app.precomputed.local = threading.local()
+    app.app_context().push()
+
+def compute_batch(batch):
+    '''
+    Compute the recommendations for the members start:end of a cluster. Their
+    cluster and low-dimensional coordinates are known, so the closest cluster
+    papers are taken straight from the coordinate snapshot.
+    '''
+    pcluster, start, end = batch
+    try:
+        model = get_model()
+        bibcodes, coordinates = model.coordinates.members(pcluster)
+        neighbours = model.coordinates.nearest_many(pcluster, coordinates[start:end], current_app.config['MAX_NEIGHBORS'])
+        results, errors = find_batch_recommendations(dict(zip(bibcodes[start:end].tolist(), neighbours)))
+    except Exception, e:
+        current_app.logger.error('Failed to compute recommendations for cluster %s, members %s-%s (%s)' % (pcluster, start, end, e))
+        return [], end - start
+    finally:
+        db.session.remove()
+    return results.items(), len(errors)
+
+def precompute_recommendations(path, processes=None, batch_size=100):
+    '''
+    Compute the recommendations for all papers in the coordinate snapshot (i.e. all
+    papers in the 'clustering' table) with a pool of worker processes, and write
+    them to a lookup table at 'path'. Returns the number of papers with recommendations
+    and the number of papers that failed.
+    '''
+    data = get_model().coordinates.current()
+    # all batches are computed with this snapshot of the model: the workers must not reload it
+    current_app.model.refresh = None
+    batches = []
+    for i, pcluster in enumerate(data['clusters']):
+        size = data['offsets'][i+1] - data['offsets'][i]
+        for start in range(0, size, batch_size):
+            batches.append((int(pcluster), start, min(start + batch_size, size)))
+    # the workers have their own connections; don't share any with them
+    db.session.remove()
+    db.get_engine(current_app).dispose()
+    writer = RecommendationWriter(path)
+    failed = 0
+    started = time.time()
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(current_app._get_current_object(),))
+    try:
+        for n, (results, errors) in enumerate(pool.imap_unordered(compute_batch, batches)):
+            writer.add(results)
+            failed += errors
+            sys.stderr.write('\r%s/%s batches, %s papers, %s failed, %.0fs' %
+                             (n + 1, len(batches), writer.count, failed, time.time() - started))
+    finally:
+        pool.close()
+        pool.join()
+    sys.stderr.write('\n')
+    writer.close()
+    return writer.count, failed
@@ -0,0 +1,54 @@
+'''
+Registry for the cluster projection matrices
+'''
+import os
+import re
+import numpy as np
+
+PROJECTION_FILE = re.compile(r'^clusterprojection_(-?\d+)\.mat\.npy$')
+
+class ProjectionRegistry(object):
+    '''
+    Holds all projection matrices found in a directory, keyed by cluster (the
+    global projection onto the 100-dimensional space has cluster -1). The matrices
+    are memory-mapped read-only, so that worker processes share the same pages.
+    Call reload() when new matrices have been deployed.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.matrices = {}
+        self.reload()
+
+    def reload(self):
+        '''
+        (Re)load all projection matrices. The new set is swapped in as a whole,
+        so that a request never sees a mix of old and new matrices
+        '''
+        matrices = {}
+        for fname in os.listdir(self.path):
+            match = PROJECTION_FILE.match(fname)
+            if not match:
+                continue
+            matrices[int(match.group(1))] = np.load(os.path.join(self.path, fname), mmap_mode='r')
+        if -1 not in matrices:
+            raise IOError('No global projection matrix found in %s' % self.path)
+        self.matrices = matrices
+        return len(matrices)
+
+    def get(self, pcluster=None):
+        '''
+        Return the projection matrix for a cluster, or the global projection
+        matrix if no cluster is specified
+        '''
+        if pcluster is None:
+            pcluster = -1
+        try:
+            return self.matrices[int(pcluster)]
+        except KeyError:
+            raise KeyError('No projection matrix for cluster %s' % pcluster)
+
+    def __contains__(self, pcluster):
+        return int(pcluster) in self.matrices
+
+    def __len__(self):
+        return len(self.matrices)
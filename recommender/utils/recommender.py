@@ -10,7 +10,8 @@ import time
 from datetime import datetime
 import simplejson as json
 from itertools import groupby
-from collections import defaultdict
+from collections import namedtuple, Counter
+import heapq
 import urllib
 import numpy as np 
 import operator
@@ -18,15 +19,29 @@ from .definitions import ASTkeywords
 from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.dialects import postgresql
-from flask import current_app
+from flask import current_app, g
 from flask.ext.sqlalchemy import SQLAlchemy
 from database import db, SQLAlchemy, CoReads, Clusters, Clustering, AlchemyEncoder
+from metrics import timed, record_solr_response
+import deadline
 
 _basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+# Column of each normalized keyword in the paper vectors
+ASTkeyword_index = dict((keyword, i) for i, keyword in enumerate(ASTkeywords))
 
 class SolrQueryError(Exception):
     pass
 
+class SparseVector(namedtuple('SparseVector', ['indices', 'weights'])):
+    '''
+    Paper vector of normalized keyword frequencies, holding only the non-zero
+    entries: the keyword columns and their frequencies
+    '''
+    def todense(self):
+        vector = np.zeros(len(ASTkeywords))
+        vector[self.indices] = self.weights
+        return vector
+
 # Helper functions
 # Data conversion
 def flatten(items):
@@ -50,20 +65,57 @@ def flatten(items):
             result.append(item)
     return result
 
-def merge_tuples(list1,list2):
-    merged = defaultdict(int)
-    merged.update(list1)
-    for key, value in list2:
-        merged[key] += value
-    return merged.items()
-
 def get_frequencies(l):
     '''
     For a list of items, return a list of tuples, consisting of
-    unique items, augemented with their frequency in the original list
+    unique items, augemented with their frequency in the original list.
+    Instead of a list, a Counter with the frequencies can be given.
+    Only the 100 most frequent items are returned (ties in alphabetical order)
+    '''
+    if not isinstance(l, Counter):
+        l = Counter(l)
+    return heapq.nsmallest(100, l.iteritems(), key=lambda a: (-a[1], a[0]))
+
+def get_model():
+    '''
+    Return the cluster model snapshot (projections, clusters and coordinates) of the
+    current request. The request is pinned to the snapshot that is active when it
+    first needs it, so that it never mixes two versions of the model.
     '''
-    tmp = [(k,len(list(g))) for k, g in groupby(sorted(l))]
-    return sorted(tmp, key=operator.itemgetter(1),reverse=True)[:100]
+    model = getattr(g, 'model', None)
+    if model is None:
+        model = g.model = current_app.model.current(current_app._get_current_object())
+    return model
+
+def submit(func, *args, **kwargs):
+    '''
+    Run a function in the thread pool of the application (within an application
+    context), so that it overlaps with work done in the current thread. Returns a future.
+    '''
+    app = current_app._get_current_object()
+    # the function adds its stage timings to those of the current request, and
+    # uses the same model snapshot and deadline
+    timings = getattr(g, 'timings', None)
+    model = get_model()
+    request_deadline = getattr(g, 'deadline', None)
+    def run():
+        with app.app_context():
+            g.timings = timings
+            g.model = model
+            g.deadline = request_deadline
+            return func(*args, **kwargs)
+    return app.executor.submit(run)
+
+def offload(func, *args):
+    '''
+    Run CPU-bound (NumPy) work in the CPU thread pool of the application, if it has one
+    (in the asynchronous serving mode, see wsgi_async.py), so that it does not block the
+    event loop. The function is called without an application context.
+    '''
+    pool = getattr(current_app, 'cpu_pool', None)
+    if pool is None:
+        return func(*args)
+    return pool.apply(func, args)
 
 def make_date(datestring):
     '''
@@ -86,7 +138,11 @@ def get_normalized_keywords(bibc):
         # Get the information from Solr
         params = {'wt':'json', 'q':q, 'fl':'keyword_norm', 'rows': current_app.config['MAX_HITS']}
         query_url = current_app.config['SOLRQUERY_URL'] + "/?" + urllib.urlencode(params)
-        resp = current_app.client.session.get(query_url).json()
+        resp = current_app.client.get(query_url, timeout=deadline.timeout(current_app.client.timeout),
+                                      slot_timeout=deadline.slot_timeout())
+        data = resp.json()
+        record_solr_response(resp, len(data['response']['docs']))
+        resp = data
     except SolrQueryError, e:
         app.logger.error("Solr keywords query for %s blew up (%s)" % (bibc,e))
         raise
@@ -95,27 +151,89 @@ def get_normalized_keywords(bibc):
             keywords += map(lambda a: a.lower(), doc['keyword_norm'])
         except:
             pass
-    return filter(lambda a: a in ASTkeywords, keywords)
+    return filter(lambda a: a in ASTkeyword_index, keywords)
+
+def get_normalized_keywords_batch(biblist):
+    '''
+    For a list of publications, construct the lists of normalized keywords of each
+    publication and its references. The publications (with their reference lists) are
+    retrieved with one bulk query, followed by one bulk query for the keywords of all
+    their references together. Returns a dictionary keyed by bibcode, for all
+    publications found in Solr
+    '''
+    try:
+        papers = solr_bulk_query(biblist, 'bibcode,keyword_norm,reference')
+        references = sorted(set(flatten([doc.get('reference', []) for doc in papers])))
+        refdocs = solr_bulk_query(references, 'bibcode,keyword_norm')
+    except SolrQueryError, e:
+        current_app.logger.error("Solr keywords query for %s blew up (%s)" % (str(biblist),e))
+        raise
+    ref_keywords = dict((doc['bibcode'], doc.get('keyword_norm', [])) for doc in refdocs)
+    keywords = {}
+    for doc in papers:
+        data = list(doc.get('keyword_norm', []))
+        for ref in set(doc.get('reference', [])):
+            data += ref_keywords.get(ref, [])
+        keywords[doc['bibcode']] = filter(lambda a: a in ASTkeyword_index, map(lambda a: a.lower(), data))
+    return keywords
+
+def solr_bulk_query(bibcodes, fl, **args):
+    '''
+    Get the Solr documents for a list of bibcodes, with the fields in 'fl'. The bibcodes
+    are sent in the request body as a terms query, split up in batches of CHUNK_SIZE
+    bibcodes that are queried concurrently. The documents of all batches are returned
+    as one list
+    '''
+    # remove duplicates, keeping the order
+    seen = set()
+    bibcodes = [b for b in bibcodes if not (b in seen or seen.add(b))]
+    client = current_app.client
+    query_url = current_app.config['SOLRQUERY_URL'] + "/"
+    chunk_size = current_app.config['CHUNK_SIZE']
+    timeout = deadline.timeout(client.timeout)
+    slot_timeout = deadline.slot_timeout()
+    queries = []
+    for i in range(0, len(bibcodes), chunk_size):
+        chunk = bibcodes[i:i+chunk_size]
+        params = {'wt':'json', 'q':'{!terms f=bibcode}%s' % ",".join(chunk), 'fl':fl, 'rows':len(chunk)}
+        params.update(args)
+        queries.append(client.executor.submit(client.post, query_url, data=params, timeout=timeout, slot_timeout=slot_timeout))
+    docs = []
+    for query in queries:
+        resp = query.result()
+        results = resp.json()['response']['docs']
+        record_solr_response(resp, len(results))
+        docs += results
+    return docs
+
+def get_metadata(biblist):
+    '''
+    Get the metadata (title, first author, citation count, publication date and
+    references) for a list of bibcodes, as a dictionary keyed by bibcode. Cached
+    metadata is used where possible; only the other bibcodes are sent to Solr
+    '''
+    cache = current_app.metadata_cache
+    docs = cache.get_many(biblist)
+    missing = [b for b in biblist if b not in docs]
+    if missing:
+        for doc in solr_bulk_query(missing, 'bibcode,title,first_author,reference,citation_count,pubdate'):
+            cache.set(doc['bibcode'], doc)
+            docs[doc['bibcode']] = doc
+    return docs
 
 def get_article_data(biblist, check_references=True):
     '''
     Get basic article metadata for a list of bibcodes
     '''
-    list = " OR ".join(map(lambda a: "bibcode:%s"%a, biblist))
-    q = '%s' % list
-    fl= 'bibcode,title,first_author,keyword_norm,reference,citation_count,pubdate'
     try:
-        # Get the information from Solr
-        params = {'wt':'json', 'q':q, 'fl':fl, 'sort':'pubdate desc, bibcode desc', 'rows': current_app.config['MAX_HITS']}
-        query_url = current_app.config['SOLRQUERY_URL'] + "/?" + urllib.urlencode(params)
-        resp = current_app.client.session.get(query_url).json()
+        results = [dict(doc) for doc in get_metadata(biblist).values()]
     except SolrQueryError, e:
-        app.logger.error("Solr article data query for %s blew up (%s)" % (str(biblist),e))
+        current_app.logger.error("Solr article data query for %s blew up (%s)" % (str(biblist),e))
         raise
-    results = resp['response']['docs']
     if check_references:
         results = filter(lambda a: 'reference' in a, results)
-        return results
+        # most recent first (sorted on 'pubdate desc, bibcode desc')
+        return sorted(results, key=lambda a: (a.get('pubdate',''), a['bibcode']), reverse=True)
     else:
         data_dict = {}
         for doc in results:
@@ -126,40 +244,165 @@ def get_article_data(biblist, check_references=True):
             data_dict[doc['bibcode']] = {'title':title, 'author':author}
         return data_dict
 
-def get_citing_papers(**args):
-    citations = []
-    bibcodes = args.get('bibcodes',[])
-    list = " OR ".join(map(lambda a: "bibcode:%s"%a, bibcodes))
-    q = '%s' % list
-    fl= 'citation'
+def get_citations(biblist):
+    '''
+    Get the papers citing each paper in a list of bibcodes, as a dictionary keyed
+    by bibcode (papers without citations are left out)
+    '''
     try:
         # Get the information from Solr
-        params = {'wt':'json', 'q':q, 'fl':fl, 'sort':'pubdate desc, bibcode desc', 'rows': current_app.config['MAX_HITS']}
-        query_url = current_app.config['SOLRQUERY_URL'] + "/?" + urllib.urlencode(params)
-        resp = current_app.client.session.get(query_url).json()
+        results = solr_bulk_query(biblist, 'bibcode,citation')
     except SolrQueryError, e:
-        app.logger.error("Solr article data query for %s blew up (%s)" % (str(biblist),e))
+        current_app.logger.error("Solr citation query for %s blew up (%s)" % (str(biblist),e))
         raise
-    for doc in resp['response']['docs']:
-        if 'citation' in doc:
-            citations += doc['citation']
+    return dict((doc['bibcode'], doc['citation']) for doc in results if 'citation' in doc)
+
+def get_citing_papers(**args):
+    citations = []
+    bibcodes = args.get('bibcodes',[])
+    for citing in get_citations(bibcodes).values():
+        citations += citing
     return citations
+
+def get_coreads(bibcodes):
+    '''
+    Get the coreads for a list of bibcodes with one query. Returns a dictionary
+    with the coreads data for every bibcode that has coreads
+    '''
+    coreads = {}
+    if not bibcodes:
+        return coreads
+    if db.session.bind.dialect.name == 'postgresql':
+        # like the Solr calls needed for any result, the query gets (at least) the CLIENT read timeout
+        db.session.execute('SET LOCAL statement_timeout = %d' % (1000*current_app.client.timeout[1]))
+    results = db.session.query(CoReads.bibcode, CoReads.coreads).filter(CoReads.bibcode.in_(bibcodes))
+    for result in results:
+        coreads.setdefault(result.bibcode, result.coreads)
+    return coreads
 #   
 # Helper Functions: Data Processing
 def make_paper_vector(bibc):
     '''
     Given a bibcode, retrieve the list of normalized keywords for this publication AND
-    its references. Then contruct a vector of normalized frequencies. This is an ordered
-    vector, i.e. the first entry is for the first normalized keyword etc etc etc
+    its references. Then contruct a vector of normalized frequencies. This is a sparse
+    vector: the column of each keyword that occurs (the first column is for the first
+    normalized keyword etc etc etc) with its normalized frequency
     '''
     data = get_normalized_keywords(bibc)
     if len(data) == 0:
         return []
-    freq = dict((ASTkeywords.index(x), float(data.count(x))/float(len(data))) for x in data)
-    FreqVec = [0.0]*len(ASTkeywords)
-    for i in freq.keys():
-        FreqVec[i] = freq[i]
-    return FreqVec
+    indices, counts = np.unique([ASTkeyword_index[x] for x in data], return_counts=True)
+    return SparseVector(indices, counts/float(len(data)))
+
+def make_paper_matrix(keywords, biblist):
+    '''
+    Batch version of make_paper_vector: given the normalized keywords of a number of
+    publications (see get_normalized_keywords_batch), construct a matrix with a row of
+    normalized frequencies for each bibcode in the list
+    '''
+    rows = []
+    columns = []
+    for i, bibc in enumerate(biblist):
+        columns += [ASTkeyword_index[x] for x in keywords.get(bibc, [])]
+        rows += [i]*(len(columns) - len(rows))
+    matrix = np.zeros((len(biblist), len(ASTkeywords)))
+    np.add.at(matrix, (rows, columns), 1.0)
+    totals = matrix.sum(axis=1)
+    totals[totals == 0] = 1.0
+    return matrix/totals[:, np.newaxis]
+
+def get_paper_vectors(bibc):
+    '''
+    Return the paper vector of a publication (see make_paper_vector) and its projection
+    onto the reduced 100-dimensional space. The paper vector is kept in the paper vector
+    cache, so that the keywords query (the heaviest Solr query) is not repeated for
+    the same paper; the projection is kept too if VECTOR_CACHE_PROJECTED is set (for
+    the version of the model it was made with).
+    '''
+    cache = current_app.vector_cache
+    version = get_model().version
+    cached = cache.get(bibc, version=version)
+    if cached is not None:
+        indices, weights, pvec = cached
+        vec = SparseVector(indices, weights)
+    else:
+        pvec = None
+        try:
+            with timed('make_paper_vector'):
+                vec = make_paper_vector(bibc)
+        except Exception, e:
+            raise Exception('make_paper_vector: failed to make paper vector (%s): %s' % (bibc,str(e)))
+    if pvec is None:
+        try:
+            with timed('project_paper'):
+                pvec = project_paper(vec)
+        except Exception, e:
+            raise Exception('project_paper: failed to project paper vector (%s): %s' % (bibc,str(e)))
+    # papers without keywords (yet) are not cached; the projection of a cached paper
+    # vector is stored again when it was made with another version of the model
+    if isinstance(vec, SparseVector) and (cached is None or (cache.projected and cached[2] is None)):
+        cache.set(bibc, vec.indices, vec.weights, pvec, version=version)
+    return vec, pvec
+
+def get_batch_paper_vectors(biblist):
+    '''
+    Batch version of get_paper_vectors: for a list of publications, return those with
+    keywords and a matrix with their projections onto the reduced 100-dimensional space,
+    a row per publication. Only the keywords of publications that are not in the paper
+    vector cache are retrieved (see get_normalized_keywords_batch).
+    '''
+    cache = current_app.vector_cache
+    model = get_model()
+    cached = cache.get_many(biblist, version=model.version)
+    missing = [b for b in biblist if b not in cached]
+    keywords = {}
+    if missing:
+        try:
+            with timed('batch_keywords'):
+                keywords = get_normalized_keywords_batch(missing)
+        except Exception, e:
+            raise Exception('get_normalized_keywords_batch: failed to get keywords: %s' % str(e))
+    papers = [b for b in biblist if b in cached or keywords.get(b)]
+    projection = model.projections.get()
+    pvecs = np.zeros((len(papers), projection.shape[1]))
+    new = [b for b in papers if b not in cached]
+    try:
+        if new:
+            matrix = make_paper_matrix(keywords, new)
+            projected = offload(np.dot, matrix, projection)
+            items = []
+            for bibc, row, pvec in zip(new, matrix, projected):
+                indices = np.flatnonzero(row)
+                items.append((bibc, indices, row[indices], pvec))
+            cache.set_many(items, version=model.version)
+            projected = dict(zip(new, projected))
+        stale = []
+        for i, bibc in enumerate(papers):
+            if bibc in cached:
+                indices, weights, pvec = cached[bibc]
+                if pvec is None:
+                    pvec = project_paper(SparseVector(indices, weights))
+                    stale.append((bibc, indices, weights, pvec))
+                pvecs[i] = pvec
+            else:
+                pvecs[i] = projected[bibc]
+        # projections made with another version of the model are stored again
+        if cache.projected:
+            cache.set_many(stale, version=model.version)
+    except Exception, e:
+        raise Exception('project_paper: failed to project paper vectors: %s' % str(e))
+    return papers, pvecs
+
+def warm_vector_cache(biblist, batch_size=100):
+    '''
+    Fill the paper vector cache for a list of publications, in batches. Returns the
+    number of publications with keywords.
+    '''
+    n = 0
+    for start in range(0, len(biblist), batch_size):
+        papers, pvecs = get_batch_paper_vectors(biblist[start:start+batch_size])
+        n += len(papers)
+    return n
 
 def project_paper(pvector,pcluster=None):
     '''
@@ -167,13 +410,10 @@ def project_paper(pvector,pcluster=None):
     for ALL normalized keywords) onto the reduced 100-dimensional space. When a cluster is specified
     the this is a cluster-specific projection to further reduce the dimensionality to 5 dimensions
     '''
-    if not pcluster:
-        pcluster = -1
-    matrix_file = "%s/%s/clusterprojection_%s.mat.npy" % (_basedir,current_app.config['CLUSTER_PROJECTION_PATH'], pcluster)
-    try:
-        projection = np.load(matrix_file)
-    except Exeption,err:
-        sys.stderr.write('Failed to load projection matrix for cluster %s (%s)'%(pclust,err))
+    projection = get_model().projections.get(pcluster)
+    if isinstance(pvector, SparseVector):
+        # Only the rows of the projection matrix for keywords that occur in the paper contribute
+        return offload(np.dot, pvector.weights, projection[pvector.indices])
     PaperVector = np.array(pvector)
     try:
         coords = np.dot(PaperVector,projection)
@@ -186,23 +426,10 @@ def find_paper_cluster(pvec,bibc):
     Given a paper vector of normalized keyword frequencies, reduced to 100 dimensions, find out
     to which cluster this paper belongs
     '''
-    try:
-        res = db.session.query(Clusters).filter(Clusters.members.any(bibc)).one()
-        cluster_data = json.dumps(result, cls=AlchemyEncoder)
-    except:
-        res = None
-    if res:
-        return cluster_data['cluster']
-
-    min_dist = 9999
-    res = db.session.query(Clusters).all()
-    clusters = json.loads(json.dumps(res, cls=AlchemyEncoder))
-    for entry in clusters:
-        centroid = entry['centroid']
-        dist = np.linalg.norm(pvec-np.array(centroid))
-        if dist < min_dist:
-            cluster = entry['cluster']
-        min_dist = min(dist, min_dist)
+    index = get_model().clusters
+    cluster = index.lookup(bibc)
+    if cluster is None:
+        cluster = index.nearest(pvec)
     return str(cluster)
 
 def find_closest_cluster_papers(pcluster,vec):
@@ -210,75 +437,98 @@ def find_closest_cluster_papers(pcluster,vec):
     Given a cluster and a paper (represented by its vector), which are the
     papers in the cluster closest to this paper?
     '''
-    # Find the cluster info for the given cluster, in particular the cluster
-    # members (identified by their bibcodes)
-    cluster_info = db.session.query(Clusters).filter(Clusters.cluster==int(pcluster)).one()
-    # For each cluster member, retrieve their lower dimensional coordinate tuple, so that
-    # we can calculate the distance of the current papers (the coordinates are stored in
-    # 'vec')
-    SQL = "SELECT * FROM clustering WHERE bibcode IN (%s)" % ",".join(map(lambda a: "\'%s\'"%a,cluster_info.members))
-    results = db.session.execute(SQL)
-    distances = []
-    for result in results:
-        paper = result[1]
-        pvect = np.array(result[4])
-        distance = np.linalg.norm(pvect-vec)
-        distances.append((paper,distance))
-    # All distances have been recorded, now sort them by distance (ascending),
-    # and return the appropriate amount
-    d = sorted(distances, key=operator.itemgetter(1),reverse=False)
-    return map(lambda a: a[0],d[:current_app.config['MAX_NEIGHBORS']])
-
-def find_recommendations(G,remove=None):
+    # The snapshot holds the lower dimensional coordinates of all cluster members,
+    # so the distances to the current paper (coordinates in 'vec') are calculated
+    # in one go, and only the closest ones are kept
+    return offload(get_model().coordinates.nearest, pcluster, vec, current_app.config['MAX_NEIGHBORS'])
+
+def aggregate_coreads(G, coreads, remove=None):
+    '''
+    Given a set of papers and their coreads (see get_coreads), return the frequency
+    distributions of the papers read just before, just after and together with them
+    '''
+    BeforeFreq = Counter()
+    AfterFreq  = Counter()
+    alsoreads  = Counter()
+    for paper in G:
+        if paper not in coreads:
+            continue
+        for bibcode, freq in coreads[paper]['before']:
+            BeforeFreq[bibcode] += freq
+            alsoreads[bibcode] += 1
+        for bibcode, freq in coreads[paper]['after']:
+            AfterFreq[bibcode] += freq
+            alsoreads[bibcode] += 1
+    # remove (if specified) the paper for which we get recommendations
+    if remove:
+        del alsoreads[remove]
+    return get_frequencies(BeforeFreq), get_frequencies(AfterFreq), get_frequencies(alsoreads)
+
+def get_coread_frequencies(G, remove=None, coreads=None):
+    '''
+    Return the frequency distributions of the papers read just before, just after and
+    together with a set of papers (see aggregate_coreads). Unless the coreads are passed
+    on, they are aggregated in the binary coreads store, if there is one (see
+    manage.py build-coreads), or else retrieved from the database.
+    '''
+    if coreads is None:
+        if current_app.coreads.available():
+            return current_app.coreads.aggregate(G, remove=remove)
+        coreads = get_coreads(G)
+    return aggregate_coreads(G, coreads, remove=remove)
+
+def find_recommendations(G,remove=None,coreads=None,citations=None):
     '''Given a set of papers (which is the set of closest papers within a given
-    cluster to the paper for which recommendations are required), find recommendations.'''
+    cluster to the paper for which recommendations are required), find recommendations.
+    The coreads of the papers and the citations of the top 100 alsoreads are retrieved,
+    unless they are passed on (as dictionaries keyed by bibcode).'''
     # Get all coreads by frequent readers who read any of the closest papers (stored in G). 
     # The coreads consist of frequencies of papers read just before, or just after the
     # paper in the closest papers.
     # The alsoreads are taken to be all the coreads taken together
-    BeforeFreq = []
-    AfterFreq  = []
-    alsoreads  = []
-    for paper in G:
-        result = db.session.query(CoReads).filter(CoReads.bibcode == paper).first()
-        if not result:
-            continue
-        BeforeFreq = merge_tuples(BeforeFreq, result.coreads['before'])
-        AfterFreq  = merge_tuples(AfterFreq, result.coreads['after'])
-        alsoreads += [x[0] for x in result.coreads['before']]
-        alsoreads += [x[0] for x in result.coreads['after']]
-    # remove (if specified) the paper for which we get recommendations
-    if remove:
-        alsoreads = filter(lambda a: a != remove, alsoreads)
-    # calculate frequency distribution of alsoreads
-    AlsoFreq  = get_frequencies(alsoreads)
+    # calculate frequency distributions of the coreads and alsoreads
+    BeforeFreq, AfterFreq, AlsoFreq = get_coread_frequencies(G, remove=remove, coreads=coreads)
     # get publication data for the top 100 most alsoread papers
     top100 = map(lambda a: a[0], AlsoFreq)
-    top100_data = get_article_data(top100)
-    # For publications with no citations, Solr docs don't have a citation count
-    tmpdata = []
-    for item in top100_data:
-        if 'citation_count' not in item:
-            item.update({'citation_count':0})
-        tmpdata.append(item)
-    top100_data = tmpdata
-    mostRecent = top100_data[0]['bibcode']
-    top100_data = sorted(top100_data, key=operator.itemgetter('citation_count'),reverse=True)
-    # get the most cited paper from the top 100 most alsoread papers
-    MostCited = top100_data[0]['bibcode']
-    # get the most papers cited BY the top 100 most alsoread papers
-    # sorted by citation
-    refs100 = flatten(map(lambda a: a['reference'], top100_data))
-    RefFreq = get_frequencies(refs100)
+    # The most recent, most cited, cited and citing papers are optional: they are
+    # left out (None) when their Solr queries would overrun the deadline of the request.
+    # The papers citing the top 100 do not depend on their publication data, so
+    # retrieve them at the same time
+    citing = None
+    if citations is None:
+        citing = submit(deadline.optional, get_citing_papers, bibcodes=top100)
+    top100_data = deadline.optional(get_article_data, top100)
+    mostRecent = MostCited = None
+    RefFreq = None
+    if top100_data is not None:
+        # For publications with no citations, Solr docs don't have a citation count
+        tmpdata = []
+        for item in top100_data:
+            if 'citation_count' not in item:
+                item.update({'citation_count':0})
+            tmpdata.append(item)
+        top100_data = tmpdata
+        mostRecent = top100_data[0]['bibcode']
+        top100_data = sorted(top100_data, key=operator.itemgetter('citation_count'),reverse=True)
+        # get the most cited paper from the top 100 most alsoread papers
+        MostCited = top100_data[0]['bibcode']
+        # get the most papers cited BY the top 100 most alsoread papers
+        # sorted by citation
+        refs100 = flatten(map(lambda a: a['reference'], top100_data))
+        RefFreq = get_frequencies(refs100)
     # get the papers that cite the top 100 most alsoread papers
     # sorted by frequency
-    cits100 = get_citing_papers(bibcodes=top100)
-    CitFreq = get_frequencies(cits100)
+    if citations is None:
+        cits100 = deadline.wait(citing)
+    else:
+        cits100 = flatten([citations.get(b, []) for b in top100])
+    CitFreq = get_frequencies(cits100) if cits100 is not None else None
     # now we have everything to build the recommendations
     FieldNames = 'Field definitions:'
     Recommendations = []
     Recommendations.append(FieldNames)
     Recommendations.append(G[0])
+    # the papers most frequently read just before and just after the closest papers
     Recommendations.append(BeforeFreq[0][0])
     if AfterFreq[0][0] == BeforeFreq[0][0]:
         try:
@@ -292,14 +542,20 @@ def find_recommendations(G,remove=None):
     except:
         Recommendations.append(AlsoFreq[0][0])
     Recommendations.append(mostRecent)
-    try:
-        Recommendations.append(rndm.choice(CitFreq[:10])[0])
-    except:
-        Recommendations.append(CitFreq[0][0])
-    try:
-        Recommendations.append(rndm.choice(RefFreq[:10])[0])
-    except:
-        Recommendations.append(RefFreq[0][0])
+    if CitFreq is None:
+        Recommendations.append(None)
+    else:
+        try:
+            Recommendations.append(rndm.choice(CitFreq[:10])[0])
+        except:
+            Recommendations.append(CitFreq[0][0])
+    if RefFreq is None:
+        Recommendations.append(None)
+    else:
+        try:
+            Recommendations.append(rndm.choice(RefFreq[:10])[0])
+        except:
+            Recommendations.append(RefFreq[0][0])
     Recommendations.append(MostCited)
 
     return Recommendations
@@ -309,40 +565,123 @@ def get_recommendations(bibcode):
     '''
     Recommendations for a single bibcode
     '''
+    vec, pvec = get_paper_vectors(bibcode)
     try:
-        vec = make_paper_vector(bibcode)
-    except Exception, e:
-        raise Exception('make_paper_vector: failed to make paper vector (%s): %s' % (bibcode,str(e)))
-    try:
-        pvec = project_paper(vec)
-    except Exception, e:
-        raise Exception('project_paper: failed to project paper vector (%s): %s' % (bibcode,str(e)))
-    try:
-        pclust = find_paper_cluster(pvec,bibcode)
+        with timed('find_paper_cluster'):
+            pclust = find_paper_cluster(pvec,bibcode)
     except Exception, e:
         raise Exception('find_paper_cluster: failed to find cluster (%s): %s' % (bibcode,str(e)))
     try:
-        cvec = project_paper(pvec,pcluster=pclust)
+        with timed('project_paper_cluster'):
+            cvec = project_paper(pvec,pcluster=pclust)
     except Exception, e:
         raise Exception('project_paper: failed to project %s within cluster %s: %s'%(bibcode,pclust, str(e)))
     try:
-        close = find_closest_cluster_papers(pclust,cvec)
+        with timed('find_closest_cluster_papers'):
+            close = find_closest_cluster_papers(pclust,cvec)
     except Exception, e:
         raise Exception('find_closest_cluster_papers: failed to find closest cluster papers (%s): %s'%(bibcode,str(e)))
     try:
-        R = find_recommendations(close,remove=bibcode)
+        with timed('find_recommendations'):
+            R = find_recommendations(close,remove=bibcode)
     except Exception, e:
         raise Exception('find_recommendations: failed to find recommendations. paper: %s, closest: %s, error: %s' % (bibcode,str(close),str(e)))
     # Get meta data for the recommendations
     try:
-        meta_dict = get_article_data(R[1:], check_references=False)
+        with timed('get_article_data'):
+            meta_dict = get_article_data(filter(None, R[1:]), check_references=False)
     except Exception, e:
         raise Exception('get_article_data: failed to retrieve article data for recommendations (%s): %s'%(bibcode,str(e)))
+    return format_recommendations(bibcode, R, meta_dict)
+
+def format_recommendations(bibcode, R, meta_dict):
+    '''
+    Combine the recommendations with their meta data
+    '''
     # Filter out any bibcodes for which no meta data was found
     recommendations = filter(lambda a: a in meta_dict, R)
 
     result = {'paper':bibcode,
               'recommendations':[{'bibcode':x,'title':meta_dict[x]['title'], 
               'author':meta_dict[x]['author']} for x in recommendations[1:]]}
+    # Optional slots were left out to meet the deadline of the request
+    if None in R:
+        result['partial'] = True
 
     return result
+
+def find_batch_recommendations(close):
+    '''
+    Given the closest cluster papers of a number of papers (a dictionary keyed by
+    bibcode), find the recommendations for all of them, with their meta data. The
+    coreads, and the publication data and citations of the top 100 alsoreads, are
+    retrieved for all papers at once. Returns a dictionary of results and a
+    dictionary of errors, both keyed by bibcode.
+    '''
+    R = {}
+    errors = {}
+    # Without a binary coreads store, get the coreads of all papers with one query
+    coreads = None
+    if not current_app.coreads.available():
+        coreads = get_coreads(list(set(flatten(close.values()))))
+    # Get the publication data and citations of the top 100 alsoreads of all papers
+    # at once, so that find_recommendations finds them in the cache, resp. gets them passed on
+    top100 = set()
+    for bibc, G in close.items():
+        top100.update([x[0] for x in get_coread_frequencies(G, remove=bibc, coreads=coreads)[2]])
+    top100 = sorted(top100)
+    # (both optional: find_recommendations leaves out the slots that need them when
+    # the deadline has passed)
+    citing = submit(deadline.optional, get_citations, top100)
+    deadline.optional(get_metadata, top100)
+    citations = deadline.wait(citing)
+    for bibc, G in close.items():
+        try:
+            R[bibc] = find_recommendations(G, remove=bibc, coreads=coreads, citations=citations)
+        except Exception, e:
+            errors[bibc] = 'failed to find recommendations: %s' % str(e)
+    # Get meta data for all recommendations
+    try:
+        meta_dict = get_article_data(sorted(set(filter(None, flatten([r[1:] for r in R.values()])))), check_references=False)
+    except Exception, e:
+        raise Exception('get_article_data: failed to retrieve article data for recommendations: %s' % str(e))
+    results = dict((bibc, format_recommendations(bibc, R[bibc], meta_dict)) for bibc in R)
+    return results, errors
+
+def get_batch_recommendations(biblist):
+    '''
+    Recommendations for a list of bibcodes. Every stage is done for all bibcodes
+    together: Solr queries in bulk, one projection onto the 100-dimensional space,
+    cluster assignment in one go, neighbour searches grouped per cluster, one coreads
+    query and one meta data lookup. Returns a result for every bibcode, with an
+    'error' instead of recommendations for bibcodes that failed.
+    '''
+    seen = set()
+    biblist = [b for b in biblist if not (b in seen or seen.add(b))]
+    errors = {}
+    papers, pvecs = get_batch_paper_vectors(biblist)
+    found = set(papers)
+    for bibc in biblist:
+        if bibc not in found:
+            errors[bibc] = 'no keywords found'
+    close = {}
+    if papers:
+        try:
+            pclusters = get_model().clusters.assign(papers, pvecs)
+        except Exception, e:
+            raise Exception('find_paper_cluster: failed to find clusters: %s' % str(e))
+        for pclust in np.unique(pclusters):
+            group = np.flatnonzero(pclusters == pclust)
+            try:
+                cvecs = np.dot(pvecs[group], get_model().projections.get(pclust))
+                neighbours = offload(get_model().coordinates.nearest_many, pclust, cvecs, current_app.config['MAX_NEIGHBORS'])
+            except Exception, e:
+                for i in group:
+                    errors[papers[i]] = 'failed to find closest cluster papers: %s' % str(e)
+                continue
+            for i, G in zip(group, neighbours):
+                close[papers[i]] = G
+    with timed('batch_recommendations'):
+        results, failed = find_batch_recommendations(close)
+    errors.update(failed)
+    return [results.get(bibc, {'paper':bibc, 'error':errors.get(bibc)}) for bibc in biblist]
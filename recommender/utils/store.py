@@ -0,0 +1,92 @@
+'''
+Lookup table of precomputed recommendations
+'''
+import os
+import time
+import zlib
+import sqlite3
+import threading
+import simplejson as json
+
+class RecommendationStore(object):
+    '''
+    Read-only lookup table of precomputed recommendations, stored in an SQLite file
+    (see RecommendationWriter) with the results as compressed JSON, keyed by bibcode.
+    When the file is replaced by a new build, the store switches over to it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        '''
+        Return the connection of the current thread, (re)opening the file if it
+        has been replaced since. Returns None if there is no lookup table.
+        '''
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        version = (stat.st_ino, stat.st_mtime)
+        if getattr(self.local, 'version', None) != version:
+            # close the connection to the replaced file, which keeps it open otherwise
+            if getattr(self.local, 'db', None) is not None:
+                self.local.db.close()
+            self.local.db = sqlite3.connect(self.path)
+            self.local.version = version
+        return self.local.db
+
+    def get(self, bibcode):
+        '''
+        Return the precomputed recommendations for a bibcode, or None
+        '''
+        db = self.connection()
+        if db is None:
+            return None
+        row = db.execute('SELECT result FROM recommendations WHERE bibcode = ?', (bibcode,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def info(self):
+        '''
+        Return the build timestamp and the number of bibcodes in the lookup table
+        '''
+        db = self.connection()
+        if db is None:
+            return {}
+        info = dict(db.execute('SELECT key, value FROM info').fetchall())
+        info['count'] = int(info.get('count', 0))
+        info['built'] = float(info.get('built', 0))
+        return info
+
+class RecommendationWriter(object):
+    '''
+    Writes a lookup table of precomputed recommendations. The table is written to a
+    temporary file, which replaces the file at 'path' when close() is called.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = '%s.tmp' % path
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.db = sqlite3.connect(self.tmp_path)
+        self.db.execute('CREATE TABLE recommendations (bibcode TEXT PRIMARY KEY, result BLOB)')
+        self.db.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+        self.count = 0
+
+    def add(self, results):
+        '''
+        Add a list of (bibcode, result) tuples
+        '''
+        self.db.executemany('INSERT OR REPLACE INTO recommendations VALUES (?, ?)',
+            [(bibcode, buffer(zlib.compress(json.dumps(result)))) for bibcode, result in results])
+        self.db.commit()
+        self.count += len(results)
+
+    def close(self):
+        self.db.executemany('INSERT INTO info VALUES (?, ?)', [('built', repr(time.time())), ('count', str(self.count))])
+        self.db.commit()
+        self.db.execute('VACUUM')
+        self.db.close()
+        os.rename(self.tmp_path, self.path)
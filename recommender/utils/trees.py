@@ -0,0 +1,76 @@
+'''
+Per-cluster KD-trees over the low-dimensional coordinates of the cluster members,
+for exact nearest neighbour queries in large clusters
+'''
+import os
+import re
+import shutil
+import cPickle as pickle
+from scipy.spatial import cKDTree
+
+TREE_FILE = re.compile(r'^clustertree_(-?\d+)\.pkl$')
+LEAF_SIZE = 16
+
+def snapshot_version(path):
+    '''
+    Return the 'built' stamp of a coordinate snapshot (or a tree directory built from one)
+    '''
+    try:
+        with open(os.path.join(path, 'built')) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+def build_trees(data, version, path, min_size):
+    '''
+    Build the KD-trees for all clusters with at least 'min_size' members in the
+    coordinate snapshot 'data' (as loaded by CoordinateSnapshot), and write them to
+    the directory 'path'. The row numbers in a tree are those of the slice of the
+    snapshot with the members of the cluster, so the trees are only valid for the
+    snapshot they were built from: its 'version' is written along with them.
+    '''
+    tmp_path = '%s.tmp' % path
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    n = 0
+    offsets = data['offsets']
+    for i, pcluster in enumerate(data['clusters']):
+        start, end = offsets[i], offsets[i+1]
+        if end - start < max(min_size, 1):
+            continue
+        tree = cKDTree(data['coordinates'][start:end], leafsize=LEAF_SIZE)
+        with open(os.path.join(tmp_path, 'clustertree_%s.pkl' % pcluster), 'wb') as f:
+            pickle.dump(tree, f, pickle.HIGHEST_PROTOCOL)
+        n += 1
+    with open(os.path.join(tmp_path, 'built'), 'w') as f:
+        f.write('%s\n' % version)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return n
+
+def load_trees(path, data, version, min_size):
+    '''
+    Load the KD-trees for the clusters with at least 'min_size' members, keyed by
+    cluster. Trees built from another snapshot than 'version', or that do not match
+    the size of their cluster in 'data', are not used (those clusters are searched
+    by brute force).
+    '''
+    trees = {}
+    if path is None or not os.path.isdir(path) or snapshot_version(path) != version:
+        return trees
+    sizes = dict(zip(data['clusters'].tolist(), (data['offsets'][1:] - data['offsets'][:-1]).tolist()))
+    for fname in os.listdir(path):
+        match = TREE_FILE.match(fname)
+        if not match:
+            continue
+        pcluster = int(match.group(1))
+        if sizes.get(pcluster, 0) < max(min_size, 1):
+            continue
+        with open(os.path.join(path, fname), 'rb') as f:
+            tree = pickle.load(f)
+        if tree.n != sizes[pcluster]:
+            continue
+        trees[pcluster] = tree
+    return trees
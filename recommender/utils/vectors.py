@@ -0,0 +1,153 @@
+'''
+Persistent cache of paper vectors
+'''
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+
+# Number of writes between checks of the size of the cache
+PRUNE_INTERVAL = 1000
+
+class VectorCache(object):
+    '''
+    Cache of paper vectors (the sparse vector of normalized keyword frequencies of a
+    paper and its references, and optionally its projection onto the reduced
+    100-dimensional space), keyed by bibcode, in an SQLite file that persists over
+    restarts and is shared by all worker processes. A projection is stored with the
+    version of the model it was made with, and only used with that same version. Entries expire 'ttl' seconds after
+    they were stored; when there are more than 'maxsize' entries, those that expire
+    first are removed. A maxsize of 0 disables the cache.
+    '''
+    def __init__(self, path, ttl=30*24*60*60, maxsize=1000000, projected=False):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.projected = projected
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def connection(self):
+        '''
+        Return the connection of the current thread, creating the cache file if needed
+        '''
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS vectors (bibcode TEXT PRIMARY KEY, expires REAL, '
+                       'indices BLOB, weights BLOB, projection BLOB, version TEXT)')
+            db.execute('CREATE INDEX IF NOT EXISTS vectors_expires ON vectors (expires)')
+            # caches written before projections had a version
+            if 'version' not in [column[1] for column in db.execute('PRAGMA table_info(vectors)')]:
+                try:
+                    db.execute('ALTER TABLE vectors ADD COLUMN version TEXT')
+                except sqlite3.OperationalError:
+                    pass
+            self.local.db = db
+        return db
+
+    def get(self, bibcode, version=None):
+        '''
+        Return the (indices, weights, projection) of the paper vector of a bibcode, or
+        None if it is not in the cache. The projection is None unless it is cached too,
+        for the model 'version'.
+        '''
+        return self.get_many([bibcode], version=version).get(bibcode)
+
+    def get_many(self, bibcodes, version=None):
+        '''
+        Return a dictionary with the cached paper vectors of a list of bibcodes
+        '''
+        found = {}
+        if not self.maxsize or not bibcodes:
+            return found
+        db = self.connection()
+        now = time.time()
+        for start in range(0, len(bibcodes), 500):
+            chunk = bibcodes[start:start+500]
+            rows = db.execute('SELECT bibcode, indices, weights, projection, version FROM vectors WHERE expires > ? AND bibcode IN (%s)' %
+                              ','.join('?'*len(chunk)), [now] + list(chunk))
+            for bibcode, indices, weights, projection, projection_version in rows:
+                if projection is not None and version is not None and projection_version == version:
+                    projection = np.frombuffer(projection, dtype=np.float64)
+                else:
+                    projection = None
+                found[bibcode] = (np.frombuffer(indices, dtype=np.int32), np.frombuffer(weights, dtype=np.float64), projection)
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(set(bibcodes)) - len(found)
+        return found
+
+    def set(self, bibcode, indices, weights, projection=None, version=None):
+        self.set_many([(bibcode, indices, weights, projection)], version=version)
+
+    def set_many(self, items, version=None):
+        '''
+        Store a list of (bibcode, indices, weights, projection) tuples, with the
+        projections made with the model 'version' (without a version, projections
+        are not stored). Failures to
+        write (for instance when another process holds the lock for too long) are
+        ignored: the vectors are computed again next time.
+        '''
+        if not self.maxsize or not items:
+            return
+        expires = time.time() + self.ttl
+        rows = []
+        for bibcode, indices, weights, projection in items:
+            if projection is not None and self.projected and version is not None:
+                projection = buffer(np.asarray(projection, dtype=np.float64).tostring())
+            else:
+                projection = None
+            rows.append((bibcode, expires, buffer(np.asarray(indices, dtype=np.int32).tostring()),
+                         buffer(np.asarray(weights, dtype=np.float64).tostring()), projection,
+                         version if projection is not None else None))
+        db = self.connection()
+        try:
+            db.execute('BEGIN')
+            db.executemany('INSERT OR REPLACE INTO vectors (bibcode, expires, indices, weights, projection, version) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            db.execute('COMMIT')
+        except sqlite3.OperationalError:
+            try:
+                db.execute('ROLLBACK')
+            except sqlite3.OperationalError:
+                pass
+            return
+        with self.lock:
+            self.writes += len(rows)
+            prune = self.writes >= PRUNE_INTERVAL
+            if prune:
+                self.writes = 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        '''
+        Remove the expired entries, and the entries that expire first when the cache
+        holds more than 'maxsize' entries
+        '''
+        db = self.connection()
+        try:
+            db.execute('DELETE FROM vectors WHERE expires <= ?', (time.time(),))
+            excess = db.execute('SELECT COUNT(*) FROM vectors').fetchone()[0] - self.maxsize
+            if excess > 0:
+                db.execute('DELETE FROM vectors WHERE bibcode IN (SELECT bibcode FROM vectors ORDER BY expires LIMIT ?)', (excess,))
+        except sqlite3.OperationalError:
+            pass
+
+    def stats(self):
+        '''
+        Hit/miss statistics of the cache
+        '''
+        if not self.maxsize or not os.path.exists(self.path):
+            entries = 0
+        else:
+            entries = self.connection().execute('SELECT COUNT(*) FROM vectors').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': float(self.hits)/lookups if lookups else 0.0}
@@ -1,10 +1,13 @@
-from flask import current_app, Blueprint, request
+from flask import current_app, Blueprint, request, g
 from flask.ext.restful import Resource
 import time
 import inspect
 import sys
+from collections import OrderedDict
 
-from utils.recommender import get_recommendations
+from utils.recommender import get_recommendations, get_batch_recommendations
+from utils.metrics import timed, count
+from utils import deadline
 
 blueprint = Blueprint(
       'recommender',
@@ -12,16 +15,105 @@ blueprint = Blueprint(
       static_folder=None,
 )
 
+def timing_headers(headers):
+    '''
+    Add the per-stage timing breakdown of the request (in milliseconds) to the
+    response headers, if it was asked for with the 'timing' parameter
+    '''
+    if request.args.get('timing'):
+        headers['X-Timing'] = ', '.join('%s=%.3f' % (stage, 1000*t) for stage, t in g.timings.items())
+    return headers
+
 class Recommender(Resource):
     """"Return recommender results for a given bibcode"""
     scopes = []
     rate_limit = [1000,60*60*24]
     def get(self, bibcode):
+       g.timings = OrderedDict()
+       deadline.start(current_app.config['REQUEST_DEADLINE'])
+       with timed('request'):
+           results = current_app.precomputed.get(bibcode)
+           if results is not None:
+               status = 'PRECOMPUTED'
+           else:
+               try:
+                   # partial results (see REQUEST_DEADLINE) are not cached
+                   results, status = current_app.result_cache.get_or_compute(bibcode, lambda: get_recommendations(bibcode),
+                                                                             cacheable=lambda r: not r.get('partial'))
+               except Exception, err:
+                   count('errors')
+                   return {'msg': 'Unable to get results! (%s)' % err}, 500
+       count('requests_%s' % status.lower())
+       if results.get('partial'):
+           count('requests_partial')
+       return results, 200, timing_headers({'X-Cache': status})
+
+class BatchRecommender(Resource):
+    """Return recommender results for a list of bibcodes (POST {"bibcodes": [...]})"""
+    scopes = []
+    rate_limit = [100,60*60*24]
+    def post(self):
        try:
-           results = get_recommendations(bibcode)
+           bibcodes = request.get_json(force=True)['bibcodes']
        except Exception, err:
+           return {'msg': 'Unable to get bibcodes from request body! (%s)' % err}, 400
+       if not isinstance(bibcodes, list) or not all(isinstance(b, basestring) for b in bibcodes):
+           return {'msg': 'The bibcodes must be given as a list of strings'}, 400
+       if len(bibcodes) > current_app.config['MAX_INPUT']:
+           return {'msg': 'Too many bibcodes (maximum is %s)' % current_app.config['MAX_INPUT']}, 400
+       # Precomputed and cached results are used; the bibcodes without one are computed together
+       cache = current_app.result_cache.backend
+       cached = dict((b, current_app.precomputed.get(b) or cache.get(b)) for b in bibcodes)
+       g.timings = OrderedDict()
+       deadline.start(current_app.config['BATCH_REQUEST_DEADLINE'])
+       try:
+           with timed('batch_request'):
+               computed = get_batch_recommendations([b for b in bibcodes if cached[b] is None])
+       except Exception, err:
+           count('errors')
            return {'msg': 'Unable to get results! (%s)' % err}, 500
-       return results
+       for result in computed:
+           if 'error' not in result and not result.get('partial'):
+               cache.set(result['paper'], result, current_app.result_cache.ttl)
+           cached[result['paper']] = result
+       return {'results': [cached[b] for b in bibcodes]}, 200, timing_headers({})
+
+class Metrics(Resource):
+    """Latency histograms per pipeline stage, counters and cache statistics"""
+    scopes = []
+    rate_limit = [1000,60*60*24]
+    def get(self):
+       report = current_app.metrics.report()
+       report['caches'] = {'metadata': current_app.metadata_cache.stats(), 'vectors': current_app.vector_cache.stats()}
+       if hasattr(current_app.result_cache.backend, 'stats'):
+           report['caches']['results'] = current_app.result_cache.backend.stats()
+       report['precomputed'] = current_app.precomputed.info()
+       report['model'] = current_app.model.info()
+       return report
+
+class Model(Resource):
+    """Version of the active cluster model snapshot; POST loads a new snapshot in the background"""
+    scopes = ['admin']
+    rate_limit = [100,60*60*24]
+    def get(self):
+       return current_app.model.info()
+
+    def post(self):
+       current_app.model.reload(current_app._get_current_object(), force=True)
+       return current_app.model.info(), 202
+
+class Ready(Resource):
+    """Readiness: 503 until the first cluster model snapshot has been loaded"""
+    scopes = []
+    rate_limit = [1000,60*60*24]
+    def get(self):
+       model = current_app.model
+       if not model.ready():
+           # the background load started at import does not survive the fork of a worker
+           # (gunicorn --preload) that happens before it is done: the worker starts its own
+           model.reload(current_app._get_current_object())
+       info = model.info()
+       return info, 200 if info['ready'] else 503
 
 class Resources(Resource):
   '''Overview of available resources'''
@@ -11,7 +11,13 @@ from werkzeug.wsgi import DispatcherMiddleware
 
 from recommender import app as recommender
 
-application = DispatcherMiddleware(recommender.create_app(),mounts={
+app = recommender.create_app()
+#Load the cluster model in the background: /ready reports when the service can take requests (and
+#starts a load in a worker that has no model and no loader, e.g. one forked by gunicorn --preload while
+#this one was running). With several worker processes, they share the model arrays on disk
+app.model.reload(app)
+
+application = DispatcherMiddleware(app,mounts={
   #'/mount1': sample_application2.create_app(), #Could have multiple API-applications at different mount points
   })
 
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+    wsgi_async
+    ~~~~~~~~~~
+
+    asynchronous entrypoint: serves the same application from a gevent event loop,
+    so that the Solr and database I/O of many requests in flight overlaps within
+    one process (instead of forking more workers)
+"""
+
+from gevent import monkey
+monkey.patch_all()
+#Make psycopg2 yield to the event loop while waiting for the database
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from werkzeug.wsgi import DispatcherMiddleware
+
+from recommender import app as recommender
+
+app = recommender.create_app()
+#Database connections are bounded by the connection pool: requests wait (without blocking
+#the event loop) for a free connection. SQLite (as used by the benchmarks) has no connection pool.
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+  app.config['SQLALCHEMY_POOL_SIZE'] = app.config['ASYNC_DB_CONNECTIONS']
+  app.config['SQLALCHEMY_MAX_OVERFLOW'] = 0
+#CPU-bound NumPy work runs in real threads, outside of the event loop
+app.cpu_pool = gevent.get_hub().threadpool
+app.cpu_pool.maxsize = app.config['ASYNC_CPU_THREADS']
+with app.app_context():
+  #Load the model data up front: it is used from the CPU threads, which have no application context
+  app.model.current()
+
+application = DispatcherMiddleware(app,mounts={
+  #'/mount1': sample_application2.create_app(), #Could have multiple API-applications at different mount points
+  })
+
+if __name__ == "__main__":
+  server = WSGIServer(('0.0.0.0', 4000), application, spawn=Pool(app.config['ASYNC_MAX_REQUESTS']))
+  server.serve_forever()